@@ -1,4 +1,4 @@
-from flask import Flask, request, send_file, jsonify, after_this_request
+from flask import Flask, Response, request, send_file, jsonify, after_this_request
 import fitz  # PyMuPDF
 import tempfile
 import json
@@ -10,10 +10,28 @@ import shutil
 import time
 from pathlib import Path
 from pptx import Presentation
-from PIL import Image, ImageDraw, ImageChops, ImageOps
+from PIL import Image, ImageColor, ImageDraw, ImageChops, ImageOps
 from io import BytesIO
 import subprocess
 import gc
+import gzip
+import itertools
+import math
+import mimetypes
+import threading
+import queue
+import socket
+import hashlib
+import uuid
+import zlib
+import multiprocessing
+from multiprocessing import connection as mp_connection
+from collections import OrderedDict, deque
+from copy import deepcopy
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from playwright.sync_api import sync_playwright
 from werkzeug.utils import secure_filename
 from urllib.parse import urlparse, unquote
@@ -33,13 +51,14 @@ except Exception:
 
 # Imports adicionais para formatar DOCX (se disponíveis)
 try:
-    from docx.shared import Pt, Cm
+    from docx.shared import Pt, Cm, Emu
     from docx.enum.text import WD_ALIGN_PARAGRAPH
     from docx.oxml import OxmlElement
     from docx.oxml.ns import qn
 except Exception:
     Pt = None
     Cm = None
+    Emu = None
     WD_ALIGN_PARAGRAPH = None
     OxmlElement = None
     qn = None
@@ -50,6 +69,11 @@ except Exception:
     textract = None
 
 # Conversão PDF->DOCX editável (opcional)
+try:
+    import fcntl  # locks de arquivo (POSIX) da fila de render
+except ImportError:
+    fcntl = None
+
 try:
     from pdf2docx import Converter  # editable PDF->DOCX
 except Exception:
@@ -112,33 +136,658 @@ def _cors_headers(resp):
     return resp
 # -----------------------------------------------------------------------------
 
-def substituir_textos(doc, substituicoes):
+# ------------------------ Caches LRU (memória e disco) ------------------------
+class MemoryLRU:
+    """LRU em memória, thread-safe, limitado por número de entradas (0 = desativado)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if self.max_entries <= 0 or key is None:
+            return None
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0 or key is None:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class DiskLRU:
+    """Armazena blobs em disco por chave, com metadados JSON ao lado e limite de bytes.
+
+    A ordem LRU é dada pelo mtime dos arquivos (atualizado a cada leitura).
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes = None  # calculado sob demanda
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        base = self.directory / key[:2]
+        return base / f"{key}.bin", base / f"{key}.json"
+
+    def _scan(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        if not self.directory.is_dir():
+            return entries
+        for f in self.directory.rglob("*.bin"):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+        return entries
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._scan())
+            return self._bytes
+
+    def get(self, key: str) -> tuple[bytes, dict] | None:
+        data_path, meta_path = self._paths(key)
+        try:
+            data = data_path.read_bytes()
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(data_path)
+        except OSError:
+            pass
+        return data, meta
+
+    def update_meta(self, key: str, meta: dict):
+        _, meta_path = self._paths(key)
+        tmp = meta_path.with_suffix(f".{threading.get_ident()}.meta.tmp")
+        try:
+            tmp.write_text(json.dumps(meta), encoding="utf-8")
+            os.replace(tmp, meta_path)
+        except OSError:
+            pass
+
+    def put(self, key: str, data, meta: dict):
+        """Grava `data` (bytes ou arquivo binário legível) sob `key`."""
+        if not self.enabled:
+            return
+        is_file = hasattr(data, "read")
+        if not is_file and len(data) > self.max_bytes:
+            return
+        data_path, _ = self._paths(key)
+        tmp = data_path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            data_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "wb") as fh:
+                if is_file:
+                    shutil.copyfileobj(data, fh)
+                else:
+                    fh.write(data)
+                size = fh.tell()
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            return
+        if size > self.max_bytes:
+            tmp.unlink(missing_ok=True)
+            return
+        # Troca do arquivo e contagem de bytes juntas, sob o lock
+        with self._lock:
+            try:
+                old_size = data_path.stat().st_size if data_path.exists() else 0
+                os.replace(tmp, data_path)
+            except OSError:
+                tmp.unlink(missing_ok=True)
+                return
+            self.update_meta(key, meta)
+            if self._bytes is None:
+                # primeira contagem: a varredura já inclui o arquivo novo
+                self._bytes = sum(sz for _, sz, _ in self._scan())
+            else:
+                self._bytes += size - old_size
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Remove os menos usados até caber no orçamento (chamado com o lock)
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        for _, size, f in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                f.unlink()
+                f.with_suffix(".json").unlink(missing_ok=True)
+            except OSError:
+                continue
+            total -= size
+        self._bytes = total
+
+
+# ------------------------ Download de URLs remotas (com cache) ------------------------
+# Todos os *_url passam por uma Session compartilhada (keep-alive, pool por host),
+# com timeouts, limite de bytes aplicado durante o streaming e spool em arquivo
+# temporário acima de um limiar de memória.
+#   FETCH_CONNECT_TIMEOUT_S="5"   FETCH_READ_TIMEOUT_S="30"
+#   FETCH_TOTAL_TIMEOUT_S="120"   (tempo máximo de um download inteiro)
+#   FETCH_MAX_MB="50"             (tamanho máximo aceito)
+#   FETCH_SPOOL_MB="8"            (acima disso o corpo vai para disco)
+#   FETCH_POOL_HOSTS="16"  FETCH_POOL_MAXSIZE="10"  (hosts em cache / conexões por host)
+# Templates remotos (pdf_url, template_url, ...) ficam em cache em disco e são
+# revalidados com ETag/Last-Modified após o TTL.
+#   REMOTE_CACHE_DIR="/tmp/gerador_cache/remote"
+#   REMOTE_CACHE_TTL_S="300"   (segundos sem revalidar; 0 = sempre revalida)
+#   REMOTE_CACHE_MAX_MB="512"  (0 = desativa o cache)
+FETCH_CONNECT_TIMEOUT_S = float(os.getenv("FETCH_CONNECT_TIMEOUT_S", "5"))
+FETCH_READ_TIMEOUT_S = float(os.getenv("FETCH_READ_TIMEOUT_S", "30"))
+FETCH_TOTAL_TIMEOUT_S = float(os.getenv("FETCH_TOTAL_TIMEOUT_S", "120"))
+FETCH_MAX_BYTES = int(float(os.getenv("FETCH_MAX_MB", "50")) * 1024 * 1024)
+FETCH_SPOOL_BYTES = int(float(os.getenv("FETCH_SPOOL_MB", "8")) * 1024 * 1024)
+FETCH_POOL_HOSTS = int(os.getenv("FETCH_POOL_HOSTS", "16"))
+FETCH_POOL_MAXSIZE = int(os.getenv("FETCH_POOL_MAXSIZE", "10"))
+REMOTE_CACHE_DIR = os.getenv("REMOTE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "gerador_cache", "remote"))
+REMOTE_CACHE_TTL_S = float(os.getenv("REMOTE_CACHE_TTL_S", "300"))
+REMOTE_CACHE_MAX_MB = int(os.getenv("REMOTE_CACHE_MAX_MB", "512"))
+
+_http = requests.Session()
+_http_adapter = requests.adapters.HTTPAdapter(
+    pool_connections=FETCH_POOL_HOSTS,
+    pool_maxsize=FETCH_POOL_MAXSIZE,
+)
+_http.mount("http://", _http_adapter)
+_http.mount("https://", _http_adapter)
+
+_remote_cache = DiskLRU(REMOTE_CACHE_DIR, REMOTE_CACHE_MAX_MB * 1024 * 1024)
+_remote_cache_lock = threading.Lock()
+_remote_cache_stats = {"hits": 0, "revalidated": 0, "misses": 0}
+
+
+class FetchError(requests.RequestException):
+    """Download recusado (tamanho acima do limite ou tempo total esgotado)."""
+
+
+def _remote_cache_bump(key: str):
+    with _remote_cache_lock:
+        _remote_cache_stats[key] += 1
+
+
+def remote_cache_stats() -> dict:
+    with _remote_cache_lock:
+        data = dict(_remote_cache_stats)
+    data["bytes"] = _remote_cache.total_bytes() if _remote_cache.enabled else 0
+    data["max_bytes"] = _remote_cache.max_bytes
+    data["ttl_s"] = REMOTE_CACHE_TTL_S
+    return data
+
+
+def _abortar_conexao(resp):
+    """Derruba o socket da resposta; um recv() bloqueado em outra thread retorna com erro."""
+    conn = getattr(resp.raw, "connection", None)
+    sock = getattr(conn, "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _http_get(url: str, headers: dict | None = None, timeout: float | None = None):
+    """GET em streaming. Retorna (response, corpo) onde corpo é um arquivo temporário
+    (em memória até FETCH_SPOOL_BYTES, depois em disco) posicionado no início,
+    ou None em respostas 304.
+    """
+    read_timeout = FETCH_READ_TIMEOUT_S if timeout is None else min(timeout, FETCH_READ_TIMEOUT_S)
+    deadline = time.monotonic() + FETCH_TOTAL_TIMEOUT_S
+    resp = _http.get(
+        url,
+        headers=headers,
+        timeout=(FETCH_CONNECT_TIMEOUT_S, read_timeout),
+        stream=True,
+    )
+    try:
+        if resp.status_code == 304:
+            return resp, None
+        resp.raise_for_status()
+        declared = resp.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > FETCH_MAX_BYTES:
+            raise FetchError(f"Arquivo remoto excede o limite de {FETCH_MAX_BYTES} bytes")
+        body = tempfile.SpooledTemporaryFile(max_size=FETCH_SPOOL_BYTES)
+        received = 0
+        # O prazo total não pode depender de um bloco terminar: um servidor que pinga
+        # um byte por vez nunca completa um bloco nem estoura o read timeout. O
+        # watchdog derruba o socket no prazo e destrava a leitura.
+        expired = threading.Event()
+
+        def _expire():
+            expired.set()
+            _abortar_conexao(resp)
+
+        watchdog = threading.Timer(max(0.0, deadline - time.monotonic()), _expire)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                received += len(chunk)
+                if received > FETCH_MAX_BYTES:
+                    raise FetchError(f"Arquivo remoto excede o limite de {FETCH_MAX_BYTES} bytes")
+                if expired.is_set():
+                    raise FetchError(f"Download excedeu {FETCH_TOTAL_TIMEOUT_S:.0f}s")
+                body.write(chunk)
+            if expired.is_set():
+                # o socket derrubado pode parecer um fim de corpo normal
+                raise FetchError(f"Download excedeu {FETCH_TOTAL_TIMEOUT_S:.0f}s")
+        except BaseException as e:
+            body.close()
+            if expired.is_set() and not isinstance(e, FetchError):
+                raise FetchError(f"Download excedeu {FETCH_TOTAL_TIMEOUT_S:.0f}s") from e
+            raise
+        finally:
+            watchdog.cancel()
+        body.seek(0)
+        return resp, body
+    finally:
+        resp.close()
+
+
+def _fetch_url(url: str, timeout: float | None = None):
+    """Baixa `url` usando o cache em disco. Retorna (arquivo binário, content-type).
+
+    Levanta requests.RequestException em falhas de rede/HTTP/limites.
+    """
+    if not _remote_cache.enabled:
+        resp, body = _http_get(url, timeout=timeout)
+        return body, resp.headers.get("Content-Type", "")
+
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    cached = _remote_cache.get(key)
+    headers = {}
+    if cached is not None:
+        data, meta = cached
+        if time.time() - meta.get("checked_at", 0) < REMOTE_CACHE_TTL_S:
+            _remote_cache_bump("hits")
+            return BytesIO(data), meta.get("content_type", "")
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    resp, body = _http_get(url, headers=headers, timeout=timeout)
+    if body is None:
+        if cached is None:
+            raise requests.HTTPError("Resposta 304 sem cópia em cache", response=resp)
+        data, meta = cached
+        meta["checked_at"] = time.time()
+        _remote_cache.update_meta(key, meta)
+        _remote_cache_bump("revalidated")
+        return BytesIO(data), meta.get("content_type", "")
+    _remote_cache_bump("misses")
+
+    content_type = resp.headers.get("Content-Type", "")
+    if "no-store" not in resp.headers.get("Cache-Control", "").lower():
+        _remote_cache.put(key, body, {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "content_type": content_type,
+            "checked_at": time.time(),
+        })
+        body.seek(0)
+    return body, content_type
+
+
+def fetch_url_file(url: str, timeout: float | None = None):
+    """Arquivo binário (seekable) com o conteúdo de `url`; o chamador deve fechá-lo."""
+    return _fetch_url(url, timeout)[0]
+
+
+def fetch_url_bytes(url: str, timeout: float | None = None) -> bytes:
+    body, _ = _fetch_url(url, timeout)
+    with body:
+        return body.read()
+
+
+def fetch_url_text(url: str, timeout: float | None = None) -> str:
+    body, content_type = _fetch_url(url, timeout)
+    with body:
+        content = body.read()
+    encoding = requests.utils.get_encoding_from_headers({"content-type": content_type}) or "utf-8"
+    try:
+        return content.decode(encoding, errors="replace")
+    except LookupError:
+        return content.decode("utf-8", errors="replace")
+# -----------------------------------------------------------------------------
+
+# ------------------------ Processamento paralelo e respostas em streaming ------------------------
+# Um único pool de processos, criado no primeiro uso e mantido entre requisições:
+# cada processo importa o app uma vez só. O PDF de cada requisição vai para os
+# processos por um arquivo temporário, lido uma vez por processo (ver _pdf_worker).
+#   PROCESS_WORKERS="<nº de CPUs>"  (processos do pool)
+#   PROCESS_START_METHOD="forkserver"  (forkserver | spawn; nunca fork: o app tem
+#                                       threads — pool do navegador, executores —
+#                                       e um fork copiaria locks no meio do uso)
+PROCESS_WORKERS = max(1, int(os.getenv("PROCESS_WORKERS", str(os.cpu_count() or 2))))
+PROCESS_START_METHOD = os.getenv("PROCESS_START_METHOD", "forkserver").strip().lower()
+if PROCESS_START_METHOD not in multiprocessing.get_all_start_methods() or PROCESS_START_METHOD == "fork":
+    PROCESS_START_METHOD = "spawn"  # forkserver não existe no Windows
+_MP_CTX = multiprocessing.get_context(PROCESS_START_METHOD)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _process_pool() -> ProcessPoolExecutor:
+    """Pool compartilhado; recriado se um processo morreu e o quebrou."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or getattr(_pool, "_broken", False):
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS, mp_context=_MP_CTX)
+        return _pool
+
+
+@contextmanager
+def pdf_para_pool(pdf_bytes: bytes):
+    """Grava o PDF num arquivo temporário e devolve o caminho usado nas tarefas do pool."""
+    fd, caminho = tempfile.mkstemp(prefix="pool_", suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(pdf_bytes)
+        yield caminho
+    finally:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+# Estado por processo do pool: PDFs recentes, por caminho (bytes e documento aberto)
+_pdfs_worker = OrderedDict()
+_PDFS_WORKER_MAX = 4
+
+
+def _pdf_worker(caminho: str) -> list:
+    item = _pdfs_worker.pop(caminho, None)
+    if item is None:
+        item = [Path(caminho).read_bytes(), None]
+    _pdfs_worker[caminho] = item
+    while len(_pdfs_worker) > _PDFS_WORKER_MAX:
+        _, antigo = _pdfs_worker.popitem(last=False)
+        if antigo[1] is not None:
+            antigo[1].close()
+    return item
+
+
+def _doc_worker(caminho: str):
+    """Documento aberto uma única vez por processo para cada PDF."""
+    item = _pdf_worker(caminho)
+    if item[1] is None:
+        item[1] = fitz.open(stream=item[0], filetype="pdf")
+    return item[1]
+
+
+def _imap_bounded(executor, fn, items, *, ordered: bool, window: int | None = None):
+    """Submete fn(*item) para cada item mantendo no máximo `window` tarefas em voo.
+
+    Gera (índice, future) conforme terminam (ou na ordem de entrada, se `ordered`).
+    """
+    window = window or PROCESS_WORKERS * 2
+    it = iter(enumerate(items))
+    pending = {}
+    done_by_idx = {}
+    next_idx = 0
+
+    def _fill():
+        while len(pending) < window:
+            try:
+                idx, item = next(it)
+            except StopIteration:
+                return
+            pending[executor.submit(fn, *item)] = idx
+
+    try:
+        _fill()
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in done:
+                idx = pending.pop(fut)
+                if ordered:
+                    done_by_idx[idx] = fut
+                else:
+                    yield idx, fut
+            if ordered:
+                while next_idx in done_by_idx:
+                    yield next_idx, done_by_idx.pop(next_idx)
+                    next_idx += 1
+            _fill()
+    finally:
+        # O pool é compartilhado: ao parar no meio, cancela só o que é desta chamada
+        for fut in pending:
+            fut.cancel()
+
+
+class _StreamBuffer:
+    """Destino de escrita não-seekable usado para gerar ZIPs em streaming."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def stream_zip(entries):
+    """Gera os bytes de um ZIP à medida que `entries` (nome, bytes) são produzidos."""
+    buf = _StreamBuffer()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for name, data in entries:
+            zf.writestr(name, data)
+            chunk = buf.drain()
+            if chunk:
+                yield chunk
+    yield buf.drain()
+
+
+def stream_multipart(entries, boundary: str):
+    """Gera um corpo multipart/mixed com uma parte por (nome, bytes), conforme ficam prontas."""
+    for name, data in entries:
+        ctype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        yield (
+            f"--{boundary}\r\n"
+            f"Content-Type: {ctype}\r\n"
+            f'Content-Disposition: attachment; filename="{name}"\r\n'
+            f"Content-Length: {len(data)}\r\n\r\n"
+        ).encode("utf-8")
+        yield data
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode("utf-8")
+
+
+#   GZIP_MIN_BYTES="8192"  (respostas de texto a partir deste tamanho vão comprimidas)
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "8192"))
+
+
+def _aceita_gzip() -> bool:
+    return request.accept_encodings["gzip"] > 0
+
+
+def json_response(payload, status: int = 200) -> Response:
+    """Como jsonify, mas com gzip para corpos grandes quando o cliente aceita."""
+    body = app.json.dumps(payload).encode("utf-8")
+    resp = Response(body, status=status, mimetype="application/json")
+    resp.vary.add("Accept-Encoding")
+    if len(body) >= GZIP_MIN_BYTES and _aceita_gzip():
+        resp.set_data(gzip.compress(body, compresslevel=6))
+        resp.headers["Content-Encoding"] = "gzip"
+    return resp
+
+
+def ndjson_stream(items):
+    """Uma linha JSON por item, enviada assim que o item é produzido."""
+    for item in items:
+        yield (app.json.dumps(item) + "\n").encode("utf-8")
+
+
+def gzip_stream(chunks):
+    """Comprime um corpo em streaming; cada pedaço é liberado (sync flush) na hora."""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield z.flush()
+
+
+def ndjson_response(items) -> Response:
+    """Resposta NDJSON em streaming (gzip se o cliente aceitar)."""
+    body = ndjson_stream(items)
+    headers = {"Vary": "Accept-Encoding"}
+    if _aceita_gzip():
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, mimetype="application/x-ndjson", headers=headers)
+
+
+# ------------------------ Índice de marcadores [CHAVE] por template ------------------------
+# Guarda, por hash do PDF, onde ficam os spans com marcadores, evitando repetir
+# page.get_text("dict") em preenchimentos do mesmo template.
+#   PLACEHOLDER_INDEX_SIZE="64"  (templates em memória; 0 = desativa)
+PLACEHOLDER_INDEX_SIZE = int(os.getenv("PLACEHOLDER_INDEX_SIZE", "64"))
+_placeholder_index = MemoryLRU(PLACEHOLDER_INDEX_SIZE)
+_MARCADOR_RE = re.compile(r"\[[^\[\]]+\]")
+
+
+def indexar_marcadores(doc) -> list[list[tuple]]:
+    """Lista, por página, as linhas que contêm marcadores.
+
+    Cada linha é uma tupla de spans (bbox, tamanho, cor, texto); o marcador pode
+    estar quebrado entre spans da mesma linha. Páginas sem '[' no texto simples
+    são puladas sem a extração "dict" (mais cara).
+    """
+    index = []
     for page in doc:
+        entries = []
+        if "[" in page.get_text("text"):
+            for block in page.get_text("dict")["blocks"]:
+                for line in block.get("lines", []):
+                    spans = tuple(
+                        (tuple(span["bbox"]), span["size"], span["color"], span["text"])
+                        for span in line.get("spans", [])
+                    )
+                    if _MARCADOR_RE.search("".join(sp[3] for sp in spans)):
+                        entries.append(spans)
+        index.append(entries)
+    return index
+
+
+def indice_marcadores(pdf_bytes: bytes, doc) -> list[list[tuple]]:
+    """Índice de marcadores do template, do cache quando o mesmo PDF já foi visto."""
+    key = hashlib.sha256(pdf_bytes).hexdigest()
+    index = _placeholder_index.get(key)
+    if index is None:
+        index = indexar_marcadores(doc)
+        _placeholder_index.put(key, index)
+    return index
+
+
+def _grupos_marcadores(spans, padrao) -> list[tuple[int, int]]:
+    """Intervalos [i, j] de spans tocados por marcadores (intervalos sobrepostos unidos)."""
+    inicios = []
+    pos = 0
+    for sp in spans:
+        inicios.append(pos)
+        pos += len(sp[3])
+
+    def span_de(offset):
+        i = 0
+        while i + 1 < len(inicios) and inicios[i + 1] <= offset:
+            i += 1
+        return i
+
+    grupos = []
+    for m in padrao.finditer("".join(sp[3] for sp in spans)):
+        i, j = span_de(m.start()), span_de(m.end() - 1)
+        if grupos and i <= grupos[-1][1]:
+            grupos[-1] = (grupos[-1][0], max(j, grupos[-1][1]))
+        else:
+            grupos.append((i, j))
+    return grupos
+
+
+def substituir_textos(doc, substituicoes, index=None):
+    if not substituicoes:
+        return
+    valores = {f"[{chave}]": str(valor) for chave, valor in substituicoes.items()}
+    # Um único padrão para todas as chaves (mais longas primeiro)
+    padrao = re.compile("|".join(re.escape(m) for m in sorted(valores, key=len, reverse=True)))
+    if index is None:
+        index = indexar_marcadores(doc)
+    for pno, linhas in enumerate(index):
+        if not linhas:
+            continue
+        page = doc[pno]
         insercoes = []
         aplicar_redaction = False
 
-        blocks = page.get_text("dict")["blocks"]
-        for block in blocks:
-            for line in block.get("lines", []):
-                for span in line.get("spans", []):
-                    texto_original = span["text"]
-                    for chave, novo_valor in substituicoes.items():
-                        marcador = f"[{chave}]"
-                        if marcador in texto_original:
-                            bbox = span["bbox"]
-                            tamanho = span["size"]
-                            cor_int = span["color"]
-                            r = (cor_int >> 16) & 255
-                            g = (cor_int >> 8) & 255
-                            b = cor_int & 255
-                            cor = (r / 255, g / 255, b / 255)
-
-                            # Marcar para redaction
-                            page.add_redact_annot(bbox, fill=(1, 1, 1), cross_out=False)
-                            aplicar_redaction = True
-
-                            novo_texto = texto_original.replace(marcador, novo_valor)
-                            insercoes.append((bbox, novo_texto, tamanho, cor))
+        for spans in linhas:
+            for i, j in _grupos_marcadores(spans, padrao):
+                bbox, tamanho, cor_int, _ = spans[i]
+                r = (cor_int >> 16) & 255
+                g = (cor_int >> 8) & 255
+                b = cor_int & 255
+                cor = (r / 255, g / 255, b / 255)
+
+                # Marcar para redaction (união dos spans envolvidos)
+                area = fitz.Rect(bbox)
+                for sp in spans[i + 1:j + 1]:
+                    area |= fitz.Rect(sp[0])
+                page.add_redact_annot(area, fill=(1, 1, 1), cross_out=False)
+                aplicar_redaction = True
+
+                texto_original = "".join(sp[3] for sp in spans[i:j + 1])
+                novo_texto = padrao.sub(lambda m: valores[m.group(0)], texto_original)
+                insercoes.append((bbox, novo_texto, tamanho, cor))
 
         if aplicar_redaction:
             page.apply_redactions()
@@ -155,12 +804,80 @@ def substituir_textos(doc, substituicoes):
                 overlay=True,
             )
 
+# ------------------------ Cache de resultados de /extrair-texto ------------------------
+# Resultado guardado por SHA-256 do arquivo + versão do extrator + opções: uploads
+# repetidos não passam por fitz, python-docx nem textract/antiword.
+#   TEXT_CACHE_DIR="<tmp>/gerador_cache/texto"
+#   TEXT_CACHE_MAX_MB="256"  (0 = desativa)
+TEXT_EXTRACTOR_VERSION = "2"  # incrementar sempre que a extração mudar
+TEXT_CACHE_DIR = os.getenv("TEXT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "gerador_cache", "texto"))
+TEXT_CACHE_MAX_MB = int(os.getenv("TEXT_CACHE_MAX_MB", "256"))
+
+_text_cache = DiskLRU(TEXT_CACHE_DIR, TEXT_CACHE_MAX_MB * 1024 * 1024)
+_text_cache_lock = threading.Lock()
+_text_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _text_cache_key(data: bytes, ext: str, *opcoes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    partes = [TEXT_EXTRACTOR_VERSION, ext, digest, *(str(o) for o in opcoes)]
+    return hashlib.sha256("|".join(partes).encode("utf-8")).hexdigest()
+
+
+def _paginas_chave(pages: list[int], total: int) -> str:
+    """Forma canônica da seleção de páginas (já normalizada por parse_page_range)
+    para a chave do cache: '', 'todas', '1-' e a lista completa caem na mesma chave.
+    A ordem é mantida, pois é a ordem da resposta.
+    """
+    if pages == list(range(total)):
+        return "todas"
+    return ",".join(str(p) for p in pages)
+
+
+def text_cache_get(key: str):
+    if not _text_cache.enabled:
+        return None
+    hit = _text_cache.get(key)
+    with _text_cache_lock:
+        _text_cache_stats["hits" if hit else "misses"] += 1
+    if hit is None:
+        return None
+    try:
+        return json.loads(hit[0])
+    except ValueError:
+        return None
+
+
+def text_cache_put(key: str, value):
+    _text_cache.put(key, json.dumps(value, ensure_ascii=False).encode("utf-8"), {"version": TEXT_EXTRACTOR_VERSION})
+
+
+def text_cache_stats() -> dict:
+    with _text_cache_lock:
+        data = dict(_text_cache_stats)
+    total = data["hits"] + data["misses"]
+    data["hit_ratio"] = round(data["hits"] / total, 4) if total else 0.0
+    data["bytes"] = _text_cache.total_bytes() if _text_cache.enabled else 0
+    data["max_bytes"] = _text_cache.max_bytes
+    data["version"] = TEXT_EXTRACTOR_VERSION
+    return data
+# -----------------------------------------------------------------------------
+
+
 @app.route('/extrair-texto', methods=['POST'])
 def extrair_texto():
     """
     Recebe um arquivo (PDF, DOC ou DOCX) via multipart/form-data (campo 'file')
     e retorna o texto extraído em JSON.
     Resposta: { "texto": "..." }
+
+    Opcionais (PDF):
+      - paginas: '1-3,5', '4-' ou 'todas' (padrão)
+      - blocos: 1/true para incluir os blocos de texto com bbox de cada página
+      - saida: json (padrão) | ndjson (uma linha {"pagina", "texto"[, "blocos"]}
+        por página, enviada assim que extraída)
+    Respostas grandes vão com gzip quando o cliente envia Accept-Encoding: gzip.
+    Resultados ficam em cache por conteúdo do arquivo (ver TEXT_CACHE_*).
     """
     uploaded = request.files.get('file')
     if not uploaded:
@@ -172,45 +889,138 @@ def extrair_texto():
 
     _, ext = os.path.splitext(filename)
     ext = (ext or '').lower()
+    if ext not in ('.pdf', '.docx', '.doc'):
+        return jsonify({"error": f"Extensão não suportada: {ext}. Use PDF, DOC ou DOCX."}), 415
+
+    saida = (request.form.get('saida') or 'json').lower()
+    if saida not in ('json', 'ndjson'):
+        return jsonify({"error": "saida deve ser 'json' ou 'ndjson'."}), 400
+    blocos = str(request.form.get('blocos', '0')).lower() in ('1', 'true', 't', 'yes', 'y')
+
+    uploaded.stream.seek(0)
+    file_bytes = uploaded.read()
+    if ext == '.pdf':
+        # PDF aberto direto dos bytes do upload, sem arquivo temporário; abrir só
+        # lê o xref, e o nº de páginas é preciso para normalizar a chave do cache
+        pdf_bytes = file_bytes
+        try:
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        except Exception as e:
+            return jsonify({"error": f"Falha ao extrair texto: {str(e)}"}), 500
+        try:
+            paginas = parse_page_range(request.form.get('paginas'), len(doc)) if len(doc) else []
+        except ValueError as e:
+            doc.close()
+            return jsonify({"error": str(e)}), 400
 
-    # Salva em arquivo temporário para lidar com libs que precisam de caminho (ex: textract)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-        tmp_path = tmp.name
-        uploaded.stream.seek(0)
-        shutil.copyfileobj(uploaded.stream, tmp)
-
-    try:
-        if ext == '.pdf':
-            texto = _extract_text_pdf(tmp_path)
-        elif ext == '.docx':
-            texto = _extract_text_docx(tmp_path)
-        elif ext == '.doc':
-            texto = _extract_text_doc(tmp_path)
-        else:
-            return jsonify({"error": f"Extensão não suportada: {ext}. Use PDF, DOC ou DOCX."}), 415
+        cache_key = _text_cache_key(file_bytes, ext, _paginas_chave(paginas, len(doc)), blocos)
+        resultado = text_cache_get(cache_key)
+        if resultado is not None:
+            doc.close()
+            if saida == 'ndjson':
+                return ndjson_response(resultado)
+            payload = {"texto": "\n".join(p["texto"] for p in resultado).strip()}
+            if blocos:
+                payload["paginas"] = resultado
+            return json_response(payload)
+
+        if saida == 'ndjson':
+            def _linhas():
+                try:
+                    extraidas = []
+                    for item in extrair_paginas_pdf(pdf_bytes, doc, paginas, blocos):
+                        extraidas.append(item)
+                        yield item
+                    text_cache_put(cache_key, extraidas)
+                except Exception as e:
+                    # Cabeçalhos já enviados: a falha vira a última linha
+                    yield {"error": f"Falha ao extrair texto: {str(e)}"}
+                finally:
+                    doc.close()
+            return ndjson_response(_linhas())
 
-        return jsonify({"texto": texto})
-    except Exception as e:
-        return jsonify({"error": f"Falha ao extrair texto: {str(e)}"}), 500
-    finally:
         try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+            resultado = list(extrair_paginas_pdf(pdf_bytes, doc, paginas, blocos))
+        except Exception as e:
+            return jsonify({"error": f"Falha ao extrair texto: {str(e)}"}), 500
+        finally:
+            doc.close()
+        text_cache_put(cache_key, resultado)
+        payload = {"texto": "\n".join(p["texto"] for p in resultado).strip()}
+        if blocos:
+            payload["paginas"] = resultado
+        return json_response(payload)
+
+    cache_key = _text_cache_key(file_bytes, ext)
+    texto = text_cache_get(cache_key)
+    if texto is None:
+        try:
+            if ext == '.docx':
+                texto = _extract_text_docx(BytesIO(file_bytes))
+            else:
+                # textract precisa de caminho em disco
+                with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+                    tmp_path = tmp.name
+                    tmp.write(file_bytes)
+                try:
+                    texto = _extract_text_doc(tmp_path)
+                finally:
+                    try:
+                        os.remove(tmp_path)
+                    except Exception:
+                        pass
+        except Exception as e:
+            return jsonify({"error": f"Falha ao extrair texto: {str(e)}"}), 500
+        text_cache_put(cache_key, texto)
 
+    if saida == 'ndjson':
+        return ndjson_response([{"texto": texto}])
+    return json_response({"texto": texto})
 
-def _extract_text_pdf(path: str) -> str:
-    doc = fitz.open(path)
-    try:
-        parts = []
-        for page in doc:
-            parts.append(page.get_text("text"))
-        return "\n".join(parts).strip()
-    finally:
-        doc.close()
+
+# Extração de PDF por página; a partir de PDF_TEXT_PARALLEL_PAGES páginas, os lotes
+# de páginas vão para o pool de processos (cada processo abre o PDF uma vez).
+#   PDF_TEXT_PARALLEL_PAGES="64"
+PDF_TEXT_PARALLEL_PAGES = int(os.getenv("PDF_TEXT_PARALLEL_PAGES", "64"))
+PDF_TEXT_CHUNK_PAGES = 16
+
+
+def texto_paginas(doc, pages: list[int], blocos: bool = False) -> list[dict]:
+    out = []
+    for idx in pages:
+        page = doc[idx]
+        item = {"pagina": idx + 1, "texto": page.get_text("text")}
+        if blocos:
+            item["blocos"] = [
+                {"bbox": [round(v, 2) for v in b[:4]], "texto": b[4]}
+                for b in page.get_text("blocks")
+                if b[6] == 0
+            ]
+        out.append(item)
+    return out
+
+
+def _texto_paginas(caminho: str, pages: list[int], blocos: bool) -> list[dict]:
+    return texto_paginas(_doc_worker(caminho), pages, blocos)
+
+
+def extrair_paginas_pdf(pdf_bytes: bytes, doc, pages: list[int], blocos: bool = False):
+    """Gera {"pagina", "texto"[, "blocos"]} por página, na ordem."""
+    if len(pages) < PDF_TEXT_PARALLEL_PAGES or PROCESS_WORKERS == 1:
+        for idx in pages:
+            yield from texto_paginas(doc, [idx], blocos)
+        return
+    with pdf_para_pool(pdf_bytes) as caminho:
+        lotes = [
+            (caminho, pages[i:i + PDF_TEXT_CHUNK_PAGES], blocos)
+            for i in range(0, len(pages), PDF_TEXT_CHUNK_PAGES)
+        ]
+        for _, fut in _imap_bounded(_process_pool(), _texto_paginas, lotes, ordered=True):
+            yield from fut.result()
 
 
-def _extract_text_docx(path: str) -> str:
+def _extract_text_docx(path) -> str:
+    """`path` pode ser caminho ou arquivo em memória (BytesIO)."""
     if Document is None:
         raise RuntimeError("Suporte a DOCX requer 'python-docx' instalado.")
     d = Document(path)
@@ -239,6 +1049,235 @@ def _extract_text_doc(path: str) -> str:
     return content.decode('utf-8', errors='replace').strip()
 
 
+# ------------------------ Extração de texto em lote (arquivo compactado) ------------------------
+# Cada arquivo do ZIP vai para um processo extrator dedicado; o que passa do tempo
+# limite tem o processo encerrado (e substituído) sem afetar os demais.
+#   TEXT_BATCH_TIMEOUT_S="60"     (por arquivo)
+#   TEXT_BATCH_MAX_FILES="5000"
+#   TEXT_BATCH_MAX_FILE_MB="50"   (tamanho descompactado de cada arquivo)
+TEXT_BATCH_TIMEOUT_S = float(os.getenv("TEXT_BATCH_TIMEOUT_S", "60"))
+TEXT_BATCH_MAX_FILES = int(os.getenv("TEXT_BATCH_MAX_FILES", "5000"))
+TEXT_BATCH_MAX_FILE_BYTES = int(float(os.getenv("TEXT_BATCH_MAX_FILE_MB", "50")) * 1024 * 1024)
+
+
+def extrair_arquivo(ext: str, data: bytes):
+    """Extrai um arquivo no mesmo formato guardado pelo cache de /extrair-texto:
+    lista de páginas para PDF, texto para DOCX/DOC.
+    """
+    if ext == '.pdf':
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            return texto_paginas(doc, list(range(len(doc))))
+    if ext == '.docx':
+        return _extract_text_docx(BytesIO(data))
+    with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+        tmp_path = tmp.name
+        tmp.write(data)
+    try:
+        return _extract_text_doc(tmp_path)
+    finally:
+        try:
+            os.remove(tmp_path)
+        except Exception:
+            pass
+
+
+def _texto_do_resultado(valor) -> str:
+    if isinstance(valor, list):
+        return "\n".join(p["texto"] for p in valor).strip()
+    return valor
+
+
+def _lote_texto_worker(conn):
+    """Processo extrator: recebe (ext, bytes), devolve ("ok", resultado) ou ("erro", msg)."""
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return
+        if msg is None:
+            return
+        ext, data = msg
+        try:
+            conn.send(("ok", extrair_arquivo(ext, data)))
+        except Exception as e:
+            conn.send(("erro", str(e)))
+
+
+# Extratores ociosos ficam vivos entre requisições (até PROCESS_WORKERS), para não
+# pagar a importação do app a cada lote
+_extratores_ociosos = []
+_extratores_lock = threading.Lock()
+
+
+def extrair_lote(tarefas, *, workers: int, timeout: float):
+    """Distribui (id, ext, bytes) entre `workers` processos extratores.
+
+    Gera (id, "ok" | "erro", resultado ou mensagem) conforme cada arquivo termina;
+    arquivo que passa de `timeout` tem o processo morto e substituído.
+    """
+    ctx = _MP_CTX
+
+    def _novo():
+        with _extratores_lock:
+            while _extratores_ociosos:
+                w = _extratores_ociosos.pop()
+                if w["proc"].is_alive():
+                    return w
+                _matar(w)
+        parent, child = ctx.Pipe()
+        proc = ctx.Process(target=_lote_texto_worker, args=(child,), daemon=True)
+        proc.start()
+        child.close()
+        return {"proc": proc, "conn": parent, "id": None, "desde": None}
+
+    def _matar(w):
+        if w["proc"].is_alive():
+            w["proc"].kill()
+        w["proc"].join()
+        w["conn"].close()
+
+    livres = [_novo() for _ in range(max(1, workers))]
+    ocupados = {}
+    it = iter(tarefas)
+    esgotado = False
+    try:
+        while True:
+            while livres and not esgotado:
+                try:
+                    tid, ext, data = next(it)
+                except StopIteration:
+                    esgotado = True
+                    break
+                w = livres.pop()
+                w["id"], w["desde"] = tid, time.monotonic()
+                w["conn"].send((ext, data))
+                ocupados[w["conn"]] = w
+            if not ocupados:
+                break
+
+            for conn in mp_connection.wait(list(ocupados), timeout=0.25):
+                w = ocupados.pop(conn)
+                try:
+                    status, valor = conn.recv()
+                except (EOFError, OSError):
+                    _matar(w)
+                    livres.append(_novo())
+                    yield w["id"], "erro", "Processo de extração encerrado inesperadamente"
+                    continue
+                livres.append(w)
+                yield w["id"], status, valor
+
+            agora = time.monotonic()
+            for conn, w in list(ocupados.items()):
+                if agora - w["desde"] > timeout:
+                    del ocupados[conn]
+                    _matar(w)
+                    livres.append(_novo())
+                    yield w["id"], "erro", f"Tempo limite de {timeout:g}s excedido"
+    finally:
+        # Livres voltam para a reserva; ocupados (lote interrompido) e o excedente morrem
+        with _extratores_lock:
+            while livres and len(_extratores_ociosos) < PROCESS_WORKERS:
+                _extratores_ociosos.append(livres.pop())
+        for w in livres + list(ocupados.values()):
+            _matar(w)
+
+
+@app.route('/extrair-texto-lote', methods=['POST'])
+def extrair_texto_lote():
+    """
+    Extrai o texto de todos os PDF/DOC/DOCX de um ZIP (campo 'file').
+    Resposta NDJSON em streaming, uma linha por arquivo assim que termina:
+      {"arquivo": "...", "texto": "..."} ou {"arquivo": "...", "error": "..."}
+    e, ao final, {"resumo": {"arquivos", "ok", "erros", "cache"}}.
+    Opcional: timeout_s (por arquivo; padrão TEXT_BATCH_TIMEOUT_S).
+    """
+    uploaded = request.files.get('file')
+    if not uploaded:
+        return jsonify({"error": "Envie o arquivo compactado no campo 'file' (multipart/form-data)."}), 400
+    try:
+        timeout = float(request.form.get('timeout_s') or TEXT_BATCH_TIMEOUT_S)
+        if timeout <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "timeout_s deve ser um número positivo"}), 400
+
+    # Cópia própria do upload: o stream da requisição é fechado antes do fim da resposta
+    archive = tempfile.TemporaryFile()
+    uploaded.stream.seek(0)
+    shutil.copyfileobj(uploaded.stream, archive)
+    archive.seek(0)
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        archive.close()
+        return jsonify({"error": "Arquivo compactado inválido (use ZIP)."}), 400
+    membros = [
+        info for info in zf.infolist()
+        if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+    ]
+    if len(membros) > TEXT_BATCH_MAX_FILES:
+        zf.close()
+        archive.close()
+        return jsonify({"error": f"Máximo de {TEXT_BATCH_MAX_FILES} arquivos por lote"}), 400
+
+    resumo = {"arquivos": len(membros), "ok": 0, "erros": 0, "cache": 0}
+    imediatos = deque()  # respostas que não passam pelos extratores (cache, recusas)
+    chaves = {}
+
+    def _tarefas():
+        for i, info in enumerate(membros):
+            nome = info.filename
+            ext = os.path.splitext(nome)[1].lower()
+            if ext not in ('.pdf', '.docx', '.doc'):
+                imediatos.append({"arquivo": nome, "error": f"Extensão não suportada: {ext}"})
+                continue
+            if info.file_size > TEXT_BATCH_MAX_FILE_BYTES:
+                imediatos.append({"arquivo": nome, "error": "Arquivo acima do tamanho máximo"})
+                continue
+            try:
+                data = zf.read(info)
+            except Exception as e:
+                imediatos.append({"arquivo": nome, "error": f"Falha ao ler do ZIP: {str(e)}"})
+                continue
+            # Mesmas chaves de /extrair-texto (todas as páginas, sem blocos)
+            chave = _text_cache_key(data, ext, "todas", False) if ext == '.pdf' else _text_cache_key(data, ext)
+            valor = text_cache_get(chave)
+            if valor is not None:
+                resumo["cache"] += 1
+                imediatos.append({"arquivo": nome, "texto": _texto_do_resultado(valor)})
+                continue
+            chaves[i] = chave
+            yield i, ext, data
+
+    def _linhas():
+        def _drenar():
+            while imediatos:
+                item = imediatos.popleft()
+                resumo["erros" if "error" in item else "ok"] += 1
+                yield item
+
+        try:
+            for i, status, valor in extrair_lote(_tarefas(), workers=PROCESS_WORKERS, timeout=timeout):
+                yield from _drenar()
+                nome = membros[i].filename
+                if status == "ok":
+                    text_cache_put(chaves.pop(i), valor)
+                    resumo["ok"] += 1
+                    yield {"arquivo": nome, "texto": _texto_do_resultado(valor)}
+                else:
+                    chaves.pop(i, None)
+                    resumo["erros"] += 1
+                    yield {"arquivo": nome, "error": f"Falha ao extrair texto: {valor}"}
+            yield from _drenar()
+            yield {"resumo": resumo}
+        finally:
+            zf.close()
+            archive.close()
+
+    return ndjson_response(_linhas())
+
+
 def _set_paragraph_bottom_border(paragraph, size_eights: int = 4, color: str = "000000"):
     """Adiciona uma borda inferior (linha) ao parágrafo via OXML.
     size_eights: espessura em oitavos de ponto (4 = 0,5 pt)
@@ -361,12 +1400,12 @@ def gerar_curriculo_docx():
     )
     if template_url:
         try:
-            resp = requests.get(template_url, timeout=30)
-            resp.raise_for_status()
+            template_src = fetch_url_file(template_url, timeout=30)
         except Exception as e:
             return jsonify({"error": f"Falha ao baixar template: {str(e)}"}), 400
         try:
-            doc = Document(BytesIO(resp.content))
+            with template_src:
+                doc = Document(template_src)
         except Exception as e:
             return jsonify({"error": f"Falha ao abrir template DOCX: {str(e)}"}), 400
         mapping = _build_text_blocks_from_payload(payload)
@@ -711,13 +1750,13 @@ def gerar_docx_de_template():
         return jsonify({"error": "Suporte a DOCX requer 'python-docx' instalado."}), 500
 
     try:
-        resp = requests.get(template_url, timeout=30)
-        resp.raise_for_status()
+        template_src = fetch_url_file(template_url, timeout=30)
     except Exception as e:
         return jsonify({"error": f"Falha ao baixar template: {str(e)}"}), 400
 
     try:
-        doc = Document(BytesIO(resp.content))
+        with template_src:
+            doc = Document(template_src)
     except Exception as e:
         return jsonify({"error": f"Falha ao abrir template DOCX: {str(e)}"}), 400
 
@@ -738,15 +1777,220 @@ def gerar_docx_de_template():
     finally:
         pass
 
+# ------------------------ Pixmap (PyMuPDF) → Pillow ------------------------
+# Rasterizações viram imagens Pillow direto dos samples do Pixmap, sem o ciclo
+# PNG (comprime → descomprime) no meio; a codificação acontece uma vez, no
+# formato final.
+_PIXMAP_MODES = {
+    (1, False): "L",
+    (2, True): "LA",
+    (3, False): "RGB",
+    (4, True): "RGBA",
+    (4, False): "CMYK",
+}
+
+
+def pixmap_to_image(pix):
+    """Imagem Pillow construída sobre `pix.samples`.
+
+    Para L/RGBA/CMYK a memória do pixmap é compartilhada (sem cópia) e a imagem
+    fica somente leitura: mantenha `pix` vivo enquanto usá-la (desenhar nela já
+    faz a cópia). RGB é desempacotado numa única passada.
+    """
+    mode = _PIXMAP_MODES.get((pix.n, bool(pix.alpha)))
+    if mode is None:
+        raise ValueError(f"Pixmap com {pix.n} canais não suportado")
+    samples = getattr(pix, "samples_mv", None)
+    if samples is None:
+        samples = pix.samples
+    return Image.frombuffer(mode, (pix.width, pix.height), samples, "raw", mode, pix.stride, 1)
+
+
+def pixmap_bytes(pix, fmt: str = "png", quality: int | None = None) -> bytes:
+    """Codifica o pixmap uma única vez no formato final (png|jpeg|webp)."""
+    fmt = fmt.lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt == "png" and pix.n in (1, 3, 4) and (pix.n != 4 or pix.alpha):
+        # encoder PNG nativo do MuPDF: direto dos samples, sem passar pelo Pillow
+        return pix.tobytes("png")
+    img = pixmap_to_image(pix)
+    # preserva a resolução (o python-docx usa o DPI do arquivo para o tamanho nativo)
+    params = {"dpi": (pix.xres, pix.yres)} if pix.xres and pix.yres else {}
+    if fmt == "jpeg":
+        if img.mode not in ("RGB", "L", "CMYK"):
+            img = img.convert("RGB")
+        params["quality"] = quality or 90
+    elif fmt == "webp" and quality:
+        params["quality"] = quality
+    out = BytesIO()
+    img.save(out, format=fmt.upper(), **params)
+    return out.getvalue()
+# -----------------------------------------------------------------------------
+
+
+# ------------------------ Rasterização de páginas (PDF → imagens) ------------------------
+# Páginas renderizadas em processos separados; cada processo abre o PDF uma única vez.
+#   PDF_IMAGE_MAX_DPI="600"
+PDF_IMAGE_MAX_DPI = int(os.getenv("PDF_IMAGE_MAX_DPI", "600"))
+CONTACT_SHEET_THUMB_W = 240
+
+
+def parse_page_range(raw, total: int) -> list[int]:
+    """Converte '1-3,5', '4-' ou 'todas' (1-based) em índices 0-based, sem repetições."""
+    raw = str(raw if raw is not None else "").strip().lower()
+    if raw in ("", "todas", "all", "*"):
+        return list(range(total))
+    pages = []
+    seen = set()
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                a, b = part.split("-", 1)
+                start = int(a) if a.strip() else 1
+                end = int(b) if b.strip() else total
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ValueError(f"Intervalo de páginas inválido: {part}")
+        if start < 1 or end < start:
+            raise ValueError(f"Intervalo de páginas inválido: {part}")
+        for num in range(start, min(end, total) + 1):
+            if num - 1 not in seen:
+                seen.add(num - 1)
+                pages.append(num - 1)
+    if not pages:
+        raise ValueError("Nenhuma página do intervalo existe no PDF")
+    return pages
+
+
+def parse_clip(raw):
+    """Retângulo de recorte em pontos PDF: [x0, y0, x1, y1] ou 'x0,y0,x1,y1'."""
+    if raw is None or raw == "":
+        return None
+    if isinstance(raw, str):
+        raw = raw.split(",")
+    try:
+        x0, y0, x1, y1 = (float(v) for v in raw)
+    except (TypeError, ValueError):
+        raise ValueError("clip deve ser [x0, y0, x1, y1] em pontos")
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError("clip deve ter x1 > x0 e y1 > y0")
+    return (x0, y0, x1, y1)
+
+
+def _parse_tamanho_saida(data: dict) -> tuple[int | None, int | None]:
+    """largura/altura (ou width/height) de saída em px, opcionais."""
+    try:
+        largura = data.get('largura') or data.get('width')
+        altura = data.get('altura') or data.get('height')
+        largura = int(largura) if largura else None
+        altura = int(altura) if altura else None
+    except (TypeError, ValueError):
+        largura = altura = -1
+    if (largura is not None and largura <= 0) or (altura is not None and altura <= 0):
+        raise ValueError("largura/altura devem ser inteiros positivos")
+    return largura, altura
+
+
+def pixmap_pagina(page, *, dpi: int | None = None, width: int | None = None,
+                  height: int | None = None, clip=None):
+    """Pixmap só da região pedida, na menor escala que atende ao tamanho de saída.
+
+    Com width/height a escala é a que faz a região (página ou clip) caber na
+    caixa pedida, sem renderizar em DPI alto para reduzir depois; sem eles, usa `dpi`.
+    """
+    rect = page.rect if clip is None else fitz.Rect(clip) & page.rect
+    if rect.is_empty:
+        raise ValueError("clip fora da página")
+    if width or height:
+        zoom = min(z for z in (
+            width / rect.width if width else None,
+            height / rect.height if height else None,
+        ) if z)
+    else:
+        zoom = (dpi or 72) / 72.0
+    zoom = min(zoom, PDF_IMAGE_MAX_DPI / 72.0)
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=rect, alpha=False)
+
+
+def rasterizar_pagina(doc, idx: int, dpi: int, fmt: str, quality: int | None, thumb_w: int = 0,
+                      width: int | None = None, height: int | None = None, clip=None):
+    """Renderiza uma página: (bytes no formato final, miniatura crua ou None)."""
+    pix = pixmap_pagina(doc[idx], dpi=dpi, width=width, height=height, clip=clip)
+    data = pixmap_bytes(pix, fmt, quality)
+    mini = None
+    if thumb_w:
+        img = pixmap_to_image(pix)
+        th = max(1, round(img.height * thumb_w / img.width))
+        img = img.resize((thumb_w, th), Image.BILINEAR, reducing_gap=2.0)
+        mini = (img.mode, img.size, img.tobytes())
+    return data, mini
+
+
+def _paginas_render(caminho: str, idx: int, dpi: int, fmt: str, quality: int | None, thumb_w: int,
+                    width: int | None, height: int | None, clip):
+    return rasterizar_pagina(_doc_worker(caminho), idx, dpi, fmt, quality, thumb_w, width, height, clip)
+
+
+def folha_de_contato(minis: list, gap: int = 8):
+    """Monta as miniaturas (na ordem das páginas) numa grade única."""
+    n = len(minis)
+    cols = max(1, math.ceil(math.sqrt(n)))
+    rows = math.ceil(n / cols)
+    cw = max(size[0] for _, size, _ in minis)
+    ch = max(size[1] for _, size, _ in minis)
+    sheet = Image.new("RGB", (cols * cw + (cols + 1) * gap, rows * ch + (rows + 1) * gap), (255, 255, 255))
+    for i, (mode, size, raw) in enumerate(minis):
+        x = gap + (i % cols) * (cw + gap)
+        y = gap + (i // cols) * (ch + gap)
+        sheet.paste(Image.frombytes(mode, size, raw), (x, y))
+    return sheet
+
+
 @app.route('/pdf-para-imagem', methods=['POST'])
 def pdf_para_imagem():
+    """
+    Rasteriza páginas de um PDF remoto.
+    Body JSON:
+      - pdf_url: URL do PDF
+      - paginas: '1' (padrão), '1-3,5', '4-' ou 'todas'
+      - dpi: resolução (padrão 150)
+      - formato: png (padrão) | jpeg | webp; quality (1-100) para jpeg/webp
+      - saida: imagem (padrão para uma página) | zip (padrão para várias) | multipart
+      - contact_sheet: true para incluir uma folha de contato com todas as páginas
+      - largura/altura (width/height): tamanho de saída em px (a escala é escolhida
+        para caber na caixa; substitui dpi)
+      - clip: [x0, y0, x1, y1] em pontos PDF; renderiza só essa região
+    """
     data = request.get_json()
     if not data or 'pdf_url' not in data:
         return {'error': 'pdf_url é obrigatório'}, 400
 
+    fmt = str(data.get('formato') or data.get('format') or 'png').lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in ('png', 'jpeg', 'webp'):
+        return {'error': 'Formato inválido. Use png, jpeg ou webp.'}, 400
+    try:
+        dpi = int(data.get('dpi') or 150)
+        quality = int(data['quality']) if data.get('quality') else None
+        if not (1 <= dpi <= PDF_IMAGE_MAX_DPI) or (quality is not None and not (1 <= quality <= 100)):
+            raise ValueError
+    except (TypeError, ValueError):
+        return {'error': f'dpi deve estar entre 1 e {PDF_IMAGE_MAX_DPI} e quality entre 1 e 100'}, 400
+    contact_sheet = str(data.get('contact_sheet', '0')).lower() in ('1', 'true', 't', 'yes', 'y')
+    try:
+        largura, altura = _parse_tamanho_saida(data)
+        clip = parse_clip(data.get('clip'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
     try:
-        response = requests.get(data['pdf_url'])
-        response.raise_for_status()
+        pdf_bytes = fetch_url_bytes(data['pdf_url'])
     except Exception as e:
         return {'error': f'Erro ao baixar PDF: {str(e)}'}, 400
 
@@ -755,32 +1999,76 @@ def pdf_para_imagem():
         pdf_filename = os.path.basename(parsed_url.path)
         pdf_filename = unquote(pdf_filename)
         nome_base = os.path.splitext(pdf_filename)[0]
-        nome_imagem = f"{nome_base}.png"
+        ext = 'jpg' if fmt == 'jpeg' else fmt
 
-        doc = fitz.open(stream=response.content, filetype="pdf")
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
         if len(doc) == 0:
             return {'error': 'PDF sem páginas'}, 400
+        try:
+            paginas = parse_page_range(data.get('paginas', '1'), len(doc))
+        except ValueError as e:
+            doc.close()
+            return {'error': str(e)}, 400
 
-        page = doc[0]
-        pix = page.get_pixmap(dpi=150)
-
-        img_bytes = BytesIO()
-        img_bytes.write(pix.tobytes("png"))
-        img_bytes.seek(0)
-
-        doc.close()
-        gc.collect()
-
-        return send_file(
-            img_bytes,
-            mimetype="image/png",
-            as_attachment=True,
-            download_name=nome_imagem
-        )
+        saida = str(data.get('saida') or ('imagem' if len(paginas) == 1 and not contact_sheet else 'zip')).lower()
+        if saida not in ('imagem', 'zip', 'multipart'):
+            doc.close()
+            return {'error': "saida deve ser 'imagem', 'zip' ou 'multipart'"}, 400
+        if saida == 'imagem' and len(paginas) > 1:
+            doc.close()
+            return {'error': "saida 'imagem' aceita apenas uma página"}, 400
 
+        if saida == 'imagem':
+            img_bytes, _ = rasterizar_pagina(doc, paginas[0], dpi, fmt, quality, 0, largura, altura, clip)
+            doc.close()
+            gc.collect()
+            return send_file(
+                BytesIO(img_bytes),
+                mimetype=f"image/{fmt}",
+                as_attachment=True,
+                download_name=f"{nome_base}.{ext}"
+            )
+        doc.close()
     except Exception as e:
         return {'error': f'Erro ao processar PDF: {str(e)}'}, 500
 
+    # Nomes dentro do ZIP/multipart e no Content-Disposition precisam ser seguros
+    nome_base = secure_filename(nome_base) or 'paginas'
+    thumb_w = CONTACT_SHEET_THUMB_W if contact_sheet else 0
+
+    def _entradas():
+        minis = {}
+        with pdf_para_pool(pdf_bytes) as caminho:
+            itens = [(caminho, idx, dpi, fmt, quality, thumb_w, largura, altura, clip) for idx in paginas]
+            for i, fut in _imap_bounded(_process_pool(), _paginas_render, itens, ordered=False):
+                nome = f"{nome_base}_p{paginas[i] + 1:03d}"
+                try:
+                    img_bytes, mini = fut.result()
+                except Exception as e:
+                    # Falha isolada por página: registra e segue
+                    yield f"{nome}.erro.txt", f"Erro ao renderizar página: {str(e)}".encode("utf-8")
+                    continue
+                if mini is not None:
+                    minis[i] = mini
+                yield f"{nome}.{ext}", img_bytes
+        if minis:
+            sheet = folha_de_contato([minis[i] for i in sorted(minis)])
+            out = BytesIO()
+            sheet.save(out, format=fmt.upper(), **({'quality': quality} if quality and fmt != 'png' else {}))
+            yield f"{nome_base}_contato.{ext}", out.getvalue()
+
+    if saida == 'multipart':
+        boundary = uuid.uuid4().hex
+        return Response(
+            stream_multipart(_entradas(), boundary),
+            content_type=f"multipart/mixed; boundary={boundary}",
+        )
+    return Response(
+        stream_zip(_entradas()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nome_base}.zip"'},
+    )
+
 
 @app.route('/preencher-pdf-url', methods=['POST'])
 def preencher_pdf_url():
@@ -789,8 +2077,7 @@ def preencher_pdf_url():
         return {'error': 'pdf_url e substituicoes são obrigatórios'}, 400
 
     try:
-        response = requests.get(data['pdf_url'])
-        response.raise_for_status()
+        pdf_bytes = fetch_url_bytes(data['pdf_url'])
     except Exception as e:
         return {'error': f'Erro ao baixar PDF: {str(e)}'}, 400
 
@@ -799,8 +2086,8 @@ def preencher_pdf_url():
         return {'error': 'Substituições inválidas ou vazias'}, 400
 
     try:
-        doc = fitz.open(stream=response.content, filetype="pdf")
-        substituir_textos(doc, substituicoes)
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        substituir_textos(doc, substituicoes, indice_marcadores(pdf_bytes, doc))
 
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_out:
             doc.save(tmp_out.name, deflate=True, garbage=4, clean=True)
@@ -814,7 +2101,165 @@ def preencher_pdf_url():
             )
     except Exception as e:
         return {'error': f'Erro ao processar PDF: {str(e)}'}, 500
-    
+
+
+def preencher_pdf_bytes(pdf_bytes: bytes, substituicoes: dict, index=None) -> bytes:
+    """Aplica as substituições numa cópia do template e devolve o PDF resultante."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        substituir_textos(doc, substituicoes, index)
+        return doc.tobytes(deflate=True, garbage=4, clean=True)
+    finally:
+        doc.close()
+
+
+# Estado por processo do lote: template e índice carregados uma única vez
+def _lote_preencher(caminho: str, index, substituicoes: dict) -> bytes:
+    return preencher_pdf_bytes(_pdf_worker(caminho)[0], substituicoes, index)
+
+
+PDF_BATCH_MAX_ITEMS = int(os.getenv("PDF_BATCH_MAX_ITEMS", "5000"))
+# saida=pdf mescla tudo num arquivo só: limite próprio (acima dele, use o ZIP) e
+# gravação em disco a cada PDF_BATCH_MERGE_CHUNK itens, para não acumular em memória
+PDF_BATCH_MERGE_MAX_ITEMS = int(os.getenv("PDF_BATCH_MERGE_MAX_ITEMS", "500"))
+PDF_BATCH_MERGE_CHUNK = max(1, int(os.getenv("PDF_BATCH_MERGE_CHUNK", "50")))
+
+
+def mesclar_pdfs_em_arquivo(partes, out_path: Path, chunk: int = PDF_BATCH_MERGE_CHUNK):
+    """Mescla os PDFs (bytes) de `partes`, em ordem, em `out_path`.
+
+    A cada `chunk` partes o documento é salvo (incrementalmente após a primeira
+    gravação) e reaberto do disco, liberando os objetos já inseridos. No fim, uma
+    gravação completa com garbage=4 junta as fontes/imagens repetidas do template
+    (cada parte traz a sua cópia) e substitui o arquivo incremental.
+    """
+    merged = fitz.open()
+    salvo = False
+    pendentes = 0
+    try:
+        for dados in partes:
+            with fitz.open(stream=dados, filetype="pdf") as parte:
+                merged.insert_pdf(parte)
+            pendentes += 1
+            if pendentes >= chunk:
+                if salvo:
+                    merged.saveIncr()
+                else:
+                    merged.save(str(out_path), deflate=True, garbage=4)
+                    salvo = True
+                merged.close()
+                merged = fitz.open(str(out_path))
+                pendentes = 0
+        if not salvo:
+            merged.save(str(out_path), deflate=True, garbage=4, clean=True)
+            return
+        if pendentes:
+            merged.saveIncr()
+    finally:
+        merged.close()
+    compacto = out_path.with_suffix(".compacto.pdf")
+    with fitz.open(str(out_path)) as doc:
+        doc.save(str(compacto), deflate=True, garbage=4, clean=True)
+    os.replace(compacto, out_path)
+
+
+@app.route('/preencher-pdf-url-lote', methods=['POST'])
+def preencher_pdf_url_lote():
+    """
+    Preenche o mesmo PDF remoto com vários conjuntos de substituições.
+    Body JSON:
+      - pdf_url: URL do template
+      - lista_substituicoes: [ { "CHAVE": "valor" }, ... ]
+      - saida: zip (padrão; um PDF por item, enviado à medida que fica pronto) | pdf (um PDF único mesclado,
+        até PDF_BATCH_MERGE_MAX_ITEMS itens)
+      - prefixo: prefixo dos nomes no ZIP (padrão: preenchido)
+    """
+    data = request.get_json()
+    if not data or 'pdf_url' not in data or 'lista_substituicoes' not in data:
+        return {'error': 'pdf_url e lista_substituicoes são obrigatórios'}, 400
+
+    lista = data['lista_substituicoes']
+    if (
+        not isinstance(lista, list)
+        or not lista
+        or not all(isinstance(item, dict) and item for item in lista)
+    ):
+        return {'error': 'lista_substituicoes deve ser uma lista de objetos não vazios'}, 400
+    if len(lista) > PDF_BATCH_MAX_ITEMS:
+        return {'error': f'Máximo de {PDF_BATCH_MAX_ITEMS} itens por lote'}, 400
+
+    saida = str(data.get('saida') or 'zip').lower()
+    if saida not in ('zip', 'pdf'):
+        return {'error': "saida deve ser 'zip' ou 'pdf'"}, 400
+    if saida == 'pdf' and len(lista) > PDF_BATCH_MERGE_MAX_ITEMS:
+        return {
+            'error': f"saida=pdf aceita no máximo {PDF_BATCH_MERGE_MAX_ITEMS} itens; "
+                     "para lotes maiores use saida=zip (enviado em streaming)"
+        }, 400
+    prefixo = secure_filename(str(data.get('prefixo') or '')) or 'preenchido'
+
+    try:
+        pdf_bytes = fetch_url_bytes(data['pdf_url'])
+    except Exception as e:
+        return {'error': f'Erro ao baixar PDF: {str(e)}'}, 400
+
+    try:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        index = indice_marcadores(pdf_bytes, doc)
+        doc.close()
+    except Exception as e:
+        return {'error': f'Erro ao processar PDF: {str(e)}'}, 500
+
+    if saida == 'pdf':
+        tmpdir_obj = tempfile.TemporaryDirectory(prefix="lote_pdf_")
+
+        @after_this_request
+        def _cleanup(response):
+            for _ in range(10):
+                try:
+                    tmpdir_obj.cleanup()
+                    break
+                except PermissionError:
+                    time.sleep(0.3)
+            return response
+
+        try:
+            out_path = Path(tmpdir_obj.name) / "mesclado.pdf"
+            with pdf_para_pool(pdf_bytes) as caminho:
+                itens = [(caminho, index, subs) for subs in lista]
+                mesclar_pdfs_em_arquivo(
+                    (fut.result() for _, fut in _imap_bounded(_process_pool(), _lote_preencher, itens, ordered=True)),
+                    out_path,
+                )
+            gc.collect()
+            return send_file(
+                str(out_path),
+                mimetype="application/pdf",
+                as_attachment=True,
+                download_name=f"{prefixo}.pdf"
+            )
+        except Exception as e:
+            return {'error': f'Erro ao processar PDF: {str(e)}'}, 500
+
+    digitos = max(4, len(str(len(lista))))
+
+    def _entradas():
+        with pdf_para_pool(pdf_bytes) as caminho:
+            itens = [(caminho, index, subs) for subs in lista]
+            for idx, fut in _imap_bounded(_process_pool(), _lote_preencher, itens, ordered=False):
+                nome = f"{prefixo}_{idx + 1:0{digitos}d}"
+                try:
+                    yield f"{nome}.pdf", fut.result()
+                except Exception as e:
+                    # Falha isolada por item: registra no ZIP e segue
+                    yield f"{nome}.erro.txt", f"Erro ao processar PDF: {str(e)}".encode("utf-8")
+
+    return Response(
+        stream_zip(_entradas()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{prefixo}.zip"'},
+    )
+
 
 @app.route('/preencher-html-url', methods=['POST'])
 def preencher_html_url():
@@ -823,9 +2268,7 @@ def preencher_html_url():
         return {'error': 'html_url e substituicoes são obrigatórios'}, 400
 
     try:
-        response = requests.get(data['html_url'])
-        response.raise_for_status()
-        html = response.text
+        html = fetch_url_text(data['html_url'])
     except Exception as e:
         return {'error': f'Erro ao baixar HTML: {str(e)}'}, 400
 
@@ -848,71 +2291,303 @@ def preencher_html_url():
     except Exception as e:
         return {'error': f'Erro ao processar HTML: {str(e)}'}, 500
 
+# ------------------------ Layout da imagem de vaga ------------------------
+# Specs por template: campo → caixa [x, y, largura(, altura)] em px na resolução
+# `dpi`, fonte, tamanho e regras de quebra/overflow. O layout "padrao" reproduz o
+# modelo original; VAGA_LAYOUTS_FILE (JSON {"nome": spec}) acrescenta/sobrescreve
+# layouts e é lido uma vez, na subida.
+#   VAGA_FONT_PATH="/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+#   VAGA_LAYOUTS_FILE="/app/layouts_vaga.json"
+# Campos aceitam: box, font, size, color, line_spacing, wrap (bool),
+# max_lines, overflow (clip|ellipsis|shrink) e min_size (para shrink).
+# Valores são validados e normalizados na subida; layout inválido responde 400.
+VAGA_FONT_PATH = os.getenv("VAGA_FONT_PATH", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+
+_VAGA_LAYOUT_PADRAO = {
+    "dpi": 300,
+    "font": VAGA_FONT_PATH,
+    "size": 28,
+    "color": "black",
+    "line_spacing": 10,
+    "fields": {
+        "cargo": {"box": [130, 420, 580]},
+        "complemento": {"box": [130, 470, 580]},
+        "Requisito 1": {"box": [130, 540, 580]},
+        "Requisito 2": {"box": [130, 580, 580]},
+        "Requisito 3": {"box": [130, 620, 580]},
+        "Requisito 4": {"box": [130, 660, 580]},
+        "Requisito 5": {"box": [130, 700, 580]},
+        "localizacao": {"box": [200, 820, 580]},
+        "modalidade": {"box": [530, 820, 580]},
+    },
+}
+
+
+_VAGA_OVERFLOW = ("clip", "ellipsis", "shrink")
+
+
+def _layout_int(valor, nome: str, minimo: int) -> int:
+    try:
+        n = int(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"{nome} deve ser um inteiro")
+    if n < minimo:
+        raise ValueError(f"{nome} deve ser >= {minimo}")
+    return n
+
+
+def _layout_estilo(spec: dict, prefixo: str) -> dict:
+    """Valida e normaliza as chaves de estilo comuns a layout e campo."""
+    out = {}
+    if "font" in spec:
+        if not isinstance(spec["font"], str) or not spec["font"]:
+            raise ValueError(f"{prefixo}font deve ser o caminho de uma fonte")
+        out["font"] = spec["font"]
+    if "size" in spec:
+        out["size"] = _layout_int(spec["size"], f"{prefixo}size", 1)
+    if "line_spacing" in spec:
+        out["line_spacing"] = _layout_int(spec["line_spacing"], f"{prefixo}line_spacing", 0)
+    if "color" in spec:
+        try:
+            ImageColor.getrgb(str(spec["color"]))
+        except ValueError:
+            raise ValueError(f"{prefixo}color inválida: {spec['color']}")
+        out["color"] = str(spec["color"])
+    return out
+
+
+def validar_layout_vaga(layout) -> dict:
+    """Devolve uma cópia normalizada do layout (números como int/float) ou levanta
+    ValueError descrevendo o primeiro valor inválido.
+    """
+    if not isinstance(layout, dict):
+        raise ValueError("layout deve ser um objeto")
+    out = _layout_estilo(layout, "")
+    out["dpi"] = _layout_int(layout.get("dpi", 300), "dpi", 1)
+    fields = layout.get("fields")
+    if not isinstance(fields, dict) or not fields:
+        raise ValueError("fields deve ser um objeto não vazio")
+    out["fields"] = {}
+    for chave, spec in fields.items():
+        prefixo = f"fields.{chave}."
+        if not isinstance(spec, dict):
+            raise ValueError(f"fields.{chave} deve ser um objeto")
+        campo = _layout_estilo(spec, prefixo)
+        box = spec.get("box")
+        try:
+            if not isinstance(box, (list, tuple)) or len(box) not in (3, 4):
+                raise TypeError
+            campo["box"] = [float(v) for v in box]
+        except (TypeError, ValueError):
+            raise ValueError(f"{prefixo}box deve ser [x, y, largura] ou [x, y, largura, altura]")
+        if campo["box"][2] <= 0 or (len(box) == 4 and campo["box"][3] <= 0):
+            raise ValueError(f"{prefixo}box deve ter largura/altura positivas")
+        if "wrap" in spec:
+            if not isinstance(spec["wrap"], bool):
+                raise ValueError(f"{prefixo}wrap deve ser true ou false")
+            campo["wrap"] = spec["wrap"]
+        if spec.get("max_lines") is not None:
+            campo["max_lines"] = _layout_int(spec["max_lines"], f"{prefixo}max_lines", 1)
+        if "min_size" in spec:
+            campo["min_size"] = _layout_int(spec["min_size"], f"{prefixo}min_size", 1)
+        if "overflow" in spec:
+            if spec["overflow"] not in _VAGA_OVERFLOW:
+                raise ValueError(f"{prefixo}overflow deve ser {', '.join(_VAGA_OVERFLOW)}")
+            campo["overflow"] = spec["overflow"]
+        out["fields"][chave] = campo
+    return out
+
+
+def _carregar_layouts_vaga() -> tuple[dict, dict]:
+    """Lê os layouts na subida. Devolve (válidos, {nome: erro}); um layout inválido
+    não derruba o app, só responde 400 quando pedido.
+    """
+    brutos = {"padrao": _VAGA_LAYOUT_PADRAO}
+    path = os.getenv("VAGA_LAYOUTS_FILE")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            brutos.update(json.load(f))
+    layouts, invalidos = {}, {}
+    for nome, layout in brutos.items():
+        try:
+            layouts[nome] = validar_layout_vaga(layout)
+        except ValueError as e:
+            invalidos[nome] = str(e)
+    return layouts, invalidos
+
+
+VAGA_LAYOUTS, VAGA_LAYOUTS_INVALIDOS = _carregar_layouts_vaga()
+
+
+@lru_cache(maxsize=64)
+def _fonte_vaga(path: str, size: int):
+    """Fonte carregada uma vez por (arquivo, tamanho)."""
+    try:
+        return ImageFont.truetype(path, size=size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _quebrar_linhas(widths: list[float], space: float, max_width: float, wrap: bool = True) -> list[tuple[int, int, float]]:
+    """Quebra por largura usando a largura de cada palavra, medida uma única vez.
+
+    Retorna (início, fim, largura) de cada linha, com índices nas palavras.
+    """
+    lines = []
+    start, cur = 0, 0.0
+    for i, w in enumerate(widths):
+        if i == start:
+            cur = w
+            continue
+        nxt = cur + space + w
+        if wrap and nxt > max_width:
+            lines.append((start, i, cur))
+            start, cur = i, w
+        else:
+            cur = nxt
+    if widths:
+        lines.append((start, len(widths), cur))
+    return lines
+
+
+def layout_campo_vaga(texto: str, spec: dict, layout: dict):
+    """Resolve um campo do layout em (fonte, tamanho, linhas, altura de linha)."""
+    box = spec["box"]
+    max_w = float(box[2])
+    max_h = float(box[3]) if len(box) > 3 else None
+    path = spec.get("font", layout.get("font", VAGA_FONT_PATH))
+    size = int(spec.get("size", layout.get("size", 28)))
+    spacing = int(spec.get("line_spacing", layout.get("line_spacing", 10)))
+    overflow = spec.get("overflow", "clip")
+    min_size = int(spec.get("min_size", 10))
+    words = str(texto).split()
+
+    while True:
+        font = _fonte_vaga(path, size)
+        widths = [font.getlength(w) for w in words]
+        space = font.getlength(" ")
+        lines = _quebrar_linhas(widths, space, max_w, wrap=spec.get("wrap", True))
+        limit = spec.get("max_lines")
+        if max_h is not None:
+            fit = max(1, int((max_h + spacing) // (size + spacing)))
+            limit = fit if limit is None else min(int(limit), fit)
+        fits = (limit is None or len(lines) <= limit) and all(lw <= max_w for _, _, lw in lines)
+        if fits or overflow != "shrink" or size <= min_size:
+            break
+        size = max(min_size, size - 2)
+
+    truncated = limit is not None and len(lines) > limit
+    if truncated:
+        lines = lines[:limit]
+    texts = [" ".join(words[a:b]) for a, b, _ in lines]
+    if overflow == "ellipsis" and lines and (truncated or lines[-1][2] > max_w):
+        a, b, lw = lines[-1]
+        ell = font.getlength("…")
+        while b - a > 1 and lw + ell > max_w:
+            b -= 1
+            lw = sum(widths[a:b]) + space * (b - a - 1)
+        last = " ".join(words[a:b])
+        # palavra única maior que a caixa: corta por caractere
+        while len(last) > 1 and lw + ell > max_w:
+            last = last[:-1]
+            lw = font.getlength(last)
+        texts[-1] = last + "…"
+    return font, size, texts, size + spacing
+
+
 @app.route('/gerar-imagem-vaga', methods=['POST'])
 def gerar_imagem_vaga():
-    def draw_text_wrap(draw, text, font, max_width, x, y, line_spacing=10):
-        words = text.split()
-        line = ""
-        lines = []
-        for word in words:
-            test_line = f"{line} {word}".strip()
-            width, _ = draw.textsize(test_line, font=font)
-            if width <= max_width:
-                line = test_line
-            else:
-                lines.append(line)
-                line = word
-        lines.append(line)
-
-        for i, line in enumerate(lines):
-            draw.text((x, y + i * (font.size + line_spacing)), line, font=font, fill="black")
+    """Preenche o modelo de vaga (PDF) conforme o layout e devolve PNG.
 
+    Body (JSON): pdf_url, substituicoes, layout (opcional, padrão "padrao") e
+    render: vector (padrão; texto desenhado no PDF e rasterizado uma vez) | raster.
+    largura/altura (px de saída) e clip ([x0, y0, x1, y1] em pontos) são opcionais:
+    no modo vetorial a página é renderizada direto nesse tamanho/região.
+    """
     data = request.get_json()
     if not data or 'pdf_url' not in data or 'substituicoes' not in data:
         return {'error': 'pdf_url e substituicoes são obrigatórios'}, 400
 
+    nome_layout = data.get('layout') or 'padrao'
+    if nome_layout in VAGA_LAYOUTS_INVALIDOS:
+        return {'error': f"Layout '{nome_layout}' inválido: {VAGA_LAYOUTS_INVALIDOS[nome_layout]}"}, 400
+    layout = VAGA_LAYOUTS.get(nome_layout)
+    if layout is None:
+        return {'error': f"Layout desconhecido. Disponíveis: {', '.join(sorted(VAGA_LAYOUTS))}"}, 400
+    render_mode = (data.get('render') or 'vector').lower()
+    if render_mode not in ('vector', 'raster'):
+        return {'error': "render deve ser 'vector' ou 'raster'"}, 400
+    try:
+        largura, altura = _parse_tamanho_saida(data)
+        clip = parse_clip(data.get('clip'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
     try:
-        response = requests.get(data['pdf_url'])
-        response.raise_for_status()
+        pdf_bytes = fetch_url_bytes(data['pdf_url'])
     except Exception as e:
         return {'error': f'Erro ao baixar PDF: {str(e)}'}, 400
 
     try:
-        doc = fitz.open(stream=response.content, filetype="pdf")
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
         page = doc[0]
-        pix = page.get_pixmap(dpi=300)
-        img = Image.open(BytesIO(pix.tobytes("png"))).convert("RGB")
-        draw = ImageDraw.Draw(img)
-
-        # Fonte segura para ambientes Linux/Docker
-        try:
-            font_padrao = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", size=28)
-        except:
-            font_padrao = ImageFont.load_default()
-
+        dpi = int(layout.get("dpi", 300))
         campos = data["substituicoes"]
 
-        # Coordenadas ajustadas com base no modelo
-        coordenadas = {
-            "cargo": (130, 420),
-            "complemento": (130, 470),
-            "Requisito 1": (130, 540),
-            "Requisito 2": (130, 580),
-            "Requisito 3": (130, 620),
-            "Requisito 4": (130, 660),
-            "Requisito 5": (130, 700),
-            "localizacao": (200, 820),
-            "modalidade": (530, 820)
-        }
-
-        for chave, pos in coordenadas.items():
+        blocos = []
+        for chave, spec in layout["fields"].items():
             texto = campos.get(chave, "")
             if texto:
-                draw_text_wrap(draw, texto, font_padrao, max_width=580, x=pos[0], y=pos[1])
+                font, size, linhas, line_h = layout_campo_vaga(texto, spec, layout)
+                color = ImageColor.getrgb(str(spec.get("color", layout.get("color", "black"))))
+                blocos.append((spec, font, size, linhas, line_h, color))
+
+        # Texto vetorial exige fonte TrueType de arquivo; senão, desenha no bitmap
+        vector = render_mode == 'vector' and all(
+            isinstance(getattr(font, "path", None), str) for _, font, _, _, _, _ in blocos
+        )
+        if vector:
+            scale = 72.0 / dpi
+            nomes = {}
+            for spec, font, size, linhas, line_h, color in blocos:
+                x, y = spec["box"][0], spec["box"][1]
+                nome = nomes.setdefault(font.path, f"vaga{len(nomes)}")
+                ascent = font.getmetrics()[0]
+                for i, linha in enumerate(linhas):
+                    page.insert_text(
+                        (x * scale, (y + i * line_h + ascent) * scale),
+                        linha,
+                        fontsize=size * scale,
+                        fontname=nome,
+                        fontfile=font.path,
+                        color=tuple(c / 255.0 for c in color[:3]),
+                    )
 
-        img_bytes = BytesIO()
-        img.save(img_bytes, format="PNG")
-        img_bytes.seek(0)
+        # Uma única rasterização; no modo vetorial o PNG sai direto do pixmap,
+        # já no tamanho/região pedidos
+        if vector:
+            pix = pixmap_pagina(page, dpi=dpi, width=largura, height=altura, clip=clip)
+            img_bytes = BytesIO(pixmap_bytes(pix, "png"))
+        else:
+            # Coordenadas do layout são px em `dpi`: desenha na página inteira e só
+            # depois recorta/reduz
+            pix = page.get_pixmap(dpi=dpi)
+            img = pixmap_to_image(pix).convert("RGB")
+            draw = ImageDraw.Draw(img)
+            for spec, font, size, linhas, line_h, color in blocos:
+                x, y = spec["box"][0], spec["box"][1]
+                for i, linha in enumerate(linhas):
+                    draw.text((x, y + i * line_h), linha, font=font, fill=color)
+            if clip:
+                f = dpi / 72.0
+                x0, y0 = page.rect.x0, page.rect.y0
+                cx0, cy0, cx1, cy1 = (round((v - o) * f) for v, o in zip(clip, (x0, y0, x0, y0)))
+                img = img.crop((max(0, cx0), max(0, cy0), min(img.width, cx1), min(img.height, cy1)))
+            if largura or altura:
+                img.thumbnail((largura or img.width * 100, altura or img.height * 100), Image.LANCZOS)
+            img_bytes = BytesIO()
+            img.save(img_bytes, format="PNG")
+            img_bytes.seek(0)
         doc.close()
         gc.collect()
 
@@ -933,14 +2608,14 @@ def pptx_para_imagens():
         return {'error': 'pptx_url é obrigatório'}, 400
 
     try:
-        response = requests.get(data['pptx_url'])
-        response.raise_for_status()
+        pptx_src = fetch_url_file(data['pptx_url'])
     except Exception as e:
         return {'error': f'Erro ao baixar PPTX: {str(e)}'}, 400
 
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pptx") as tmp_pptx:
-            tmp_pptx.write(response.content)
+            with pptx_src:
+                shutil.copyfileobj(pptx_src, tmp_pptx)
             pptx_path = tmp_pptx.name
 
         output_dir = tempfile.mkdtemp()
@@ -975,6 +2650,55 @@ def pptx_para_imagens():
         return {'error': f'Erro ao processar PPTX: {str(e)}'}, 500
 
 
+def _blank_ratios(im, threshold=250):
+    """Fração de pixels "em branco" (cinza >= threshold) por linha e por coluna.
+
+    Tudo em C via Pillow: a máscara sai de uma LUT (point) e as médias de cada
+    linha/coluna de um resize BOX em modo 'F' para 1 px, em vez de varrer pixel a pixel.
+    """
+    if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
+        # Transparente conta como fundo (branco)
+        rgba = im.convert('RGBA')
+        im = Image.alpha_composite(Image.new('RGBA', rgba.size, (255, 255, 255, 255)), rgba)
+    gray = im.convert('L')
+    mask = gray.point(lambda v: 255 if v >= threshold else 0).convert('F')
+    width, height = gray.size
+    rows = mask.resize((1, height), Image.BOX).getdata()
+    cols = mask.resize((width, 1), Image.BOX).getdata()
+    return [v / 255.0 for v in rows], [v / 255.0 for v in cols]
+
+
+def trim_blank(im, threshold=250, blank_ratio=0.99, *, sides=True):
+    """Remove faixas em branco das bordas (topo/base; também esquerda/direita se `sides`).
+
+    Uma linha (ou coluna) é branca quando >= blank_ratio dos seus pixels têm cinza
+    >= threshold. Imagem inteiramente branca é devolvida sem corte.
+    """
+    rows, cols = _blank_ratios(im, threshold)
+    # tolerância para o arredondamento das médias em float
+    limit = blank_ratio - 1e-6
+
+    def _span(ratios):
+        first = 0
+        last = len(ratios) - 1
+        while first < len(ratios) and ratios[first] >= limit:
+            first += 1
+        while last > first and ratios[last] >= limit:
+            last -= 1
+        return first, last
+
+    top, bottom = _span(rows)
+    if top >= len(rows):
+        return im
+    left, right = _span(cols) if sides else (0, im.size[0] - 1)
+    if left >= len(cols):
+        return im
+    box = (left, top, right + 1, bottom + 1)
+    if box == (0, 0) + im.size:
+        return im
+    return im.crop(box)
+
+
 @app.route('/redimensionar-imagem', methods=['POST'])
 def redimensionar_imagem():
     if 'image' not in request.files:
@@ -993,13 +2717,18 @@ def redimensionar_imagem():
     except ValueError:
         return {'error': 'Largura e altura devem ser números inteiros positivos'}, 400
 
+    # auto_trim=1: remove bordas em branco (todos os lados) antes de redimensionar
+    auto_trim = str(request.form.get('auto_trim', '0')).lower() in ('1', 'true', 't', 'yes', 'y')
+
     try:
         img_file = request.files['image']
         img = Image.open(img_file.stream)
+        formato = img.format or 'PNG'
+        if auto_trim:
+            img = trim_blank(img)
         img = img.resize((largura, altura))
 
         output = BytesIO()
-        formato = img.format or 'PNG'
         img.save(output, format=formato)
         output.seek(0)
 
@@ -1058,27 +2787,7 @@ def cortar_redimensionar_imagem():
         img = Image.open(img_file.stream).convert('RGB')
         background_color = img.getpixel((0, 0))
 
-        def crop_blank_top_bottom(im, threshold=250, blank_ratio=0.99):
-            gray = im.convert('L')
-            width, height = gray.size
-            pixels = gray.load()
-
-            def row_is_blank(y):
-                blank = 0
-                for x in range(width):
-                    if pixels[x, y] >= threshold:
-                        blank += 1
-                return blank / width >= blank_ratio
-
-            top = 0
-            bottom = height - 1
-            while top < height and row_is_blank(top):
-                top += 1
-            while bottom > top and row_is_blank(bottom):
-                bottom -= 1
-            return im.crop((0, top, width, bottom + 1))
-
-        img = crop_blank_top_bottom(img)
+        img = trim_blank(img, sides=False)
 
 
         width, height = img.size
@@ -1119,15 +2828,15 @@ def pptx_para_pdf():
         return {'error': 'pptx_url e substituicoes são obrigatórios'}, 400
 
     try:
-        response = requests.get(data['pptx_url'])
-        response.raise_for_status()
+        pptx_src = fetch_url_file(data['pptx_url'])
     except Exception as e:
         return {'error': f'Erro ao baixar PPTX: {str(e)}'}, 400
 
     try:
         substituicoes = data['substituicoes']
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pptx") as tmp_pptx:
-            tmp_pptx.write(response.content)
+            with pptx_src:
+                shutil.copyfileobj(pptx_src, tmp_pptx)
             pptx_path = tmp_pptx.name
 
         prs = Presentation(pptx_path)
@@ -1200,6 +2909,11 @@ PRESET           = "medium"
 PIX_FMT          = "yuv420p"
 PROFILE          = "high"
 LEVEL            = "4.0"
+# Captura: "realtime" (gravação de vídeo do Playwright) ou "frames" (tempo virtual, quadro a quadro, via pipe p/ ffmpeg)
+CAPTURE_MODE     = "realtime"
+FRAME_JPEG_QUALITY = 90      # qualidade dos quadros no modo "frames"
+ANALYSIS_WIDTH   = 160       # largura dos quadros usados na detecção de cena do auto-trim
+TAIL_ANALYSIS_S  = 3.0       # janela final (s) lida no auto-trim do final; dobra enquanto não achar mudança
 # =======================================================
 
 
@@ -1221,19 +2935,305 @@ def has_wkhtmltoimage() -> bool:
     return shutil.which("wkhtmltoimage") is not None
 
 
-def measure_body_size(html_path: Path) -> tuple[int, int]:
-    """Abre SEM gravação, mede o tamanho real do <body> e devolve (w,h)."""
-    with sync_playwright() as p:
+# ------------------------ Pool de navegadores (Chromium) ------------------------
+# Mantém navegadores Chromium aquecidos em threads dedicadas (cada thread é dona do
+# seu loop Playwright). Cada requisição recebe um contexto isolado e descartável.
+# Configure via envs:
+#   BROWSER_POOL_SIZE="2"        (navegadores/threads simultâneos)
+#   BROWSER_MAX_JOBS="200"       (recicla o navegador após N jobs)
+#   BROWSER_MAX_RSS_MB="1500"    (recicla se o RSS do navegador — driver do Playwright e Chromium — passar disso; 0 = desativa)
+#   BROWSER_RSS_CHECK_S="10"     (intervalo mínimo entre medições de RSS de cada navegador)
+#   BROWSER_JOB_TIMEOUT_S="600"  (espera máxima de uma requisição pelo pool, fila incluída)
+BROWSER_POOL_SIZE = max(1, int(os.getenv("BROWSER_POOL_SIZE", "2")))
+BROWSER_MAX_JOBS = max(1, int(os.getenv("BROWSER_MAX_JOBS", "200")))
+BROWSER_MAX_RSS_MB = int(os.getenv("BROWSER_MAX_RSS_MB", "1500"))
+BROWSER_RSS_CHECK_S = float(os.getenv("BROWSER_RSS_CHECK_S", "10"))
+BROWSER_JOB_TIMEOUT_S = float(os.getenv("BROWSER_JOB_TIMEOUT_S", "600"))
+# Serializa a subida dos drivers, para cada thread saber qual processo é o seu
+_driver_start_lock = threading.Lock()
+
+
+def _proc_table() -> dict:
+    """{pid: (ppid, RSS em kB)} de todos os processos (apenas Linux; senão vazio)."""
+    proc = Path("/proc")
+    table = {}
+    if not proc.is_dir():
+        return table
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
         try:
-            browser = p.chromium.launch(headless=True)
+            status = (entry / "status").read_text()
         except Exception:
-            browser = p.chromium.launch(headless=True, args=['--no-sandbox'])  # Docker fallback
-        ctx = browser.new_context(
-            viewport={"width": 1080, "height": 1350},
-            device_scale_factor=1.0,
-            java_script_enabled=True,
-            timezone_id=TIMEZONE_ID,
-        )
+            continue
+        ppid = None
+        vmrss = 0
+        for line in status.splitlines():
+            if line.startswith("PPid:"):
+                ppid = int(line.split()[1])
+            elif line.startswith("VmRSS:"):
+                vmrss = int(line.split()[1])
+        table[int(entry.name)] = (ppid, vmrss)
+    return table
+
+
+def _tree_rss_mb(roots) -> float:
+    """Soma o RSS (MB) dos processos `roots` e de todos os seus descendentes."""
+    roots = set(roots)
+    if not roots:
+        return 0.0
+    table = _proc_table()
+    total_kb = 0
+    for pid, (ppid, vmrss) in table.items():
+        cur, seen = pid, 0
+        while cur and seen < 64:
+            if cur in roots:
+                total_kb += vmrss
+                break
+            cur = table.get(cur, (None, 0))[0]
+            seen += 1
+    return total_kb / 1024.0
+
+
+def _playwright_drivers() -> set[int]:
+    """PIDs dos drivers do Playwright (node ... run-driver) filhos deste processo."""
+    pids = set()
+    for pid, (ppid, _) in _proc_table().items():
+        if ppid != os.getpid():
+            continue
+        try:
+            cmdline = Path(f"/proc/{pid}/cmdline").read_bytes()
+        except OSError:
+            continue
+        if b"run-driver" in cmdline:
+            pids.add(pid)
+    return pids
+
+
+def _launch_chromium(p):
+    try:
+        return p.chromium.launch(headless=True)
+    except Exception:
+        return p.chromium.launch(headless=True, args=['--no-sandbox'])  # Docker fallback
+
+
+class BrowserPool:
+    """Pool de navegadores Chromium persistentes.
+
+    `run(fn, **context_options)` executa `fn(ctx)` numa thread do pool com um
+    contexto novo (criado com `context_options`) e devolve o resultado. O contexto é
+    fechado ao final, mesmo em caso de erro.
+    """
+
+    def __init__(self, size: int, max_jobs: int, max_rss_mb: int, timeout: float = BROWSER_JOB_TIMEOUT_S):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.timeout = timeout
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stats = {
+            "contexts_in_use": 0,
+            "jobs": 0,
+            "errors": 0,
+            "launches": 0,
+            "recycles": 0,
+            "worker_restarts": 0,
+        }
+        self._last_error = None
+        self._alive = 0
+        self._drivers = {}  # thread → PID do driver do Playwright
+
+    def _ensure_started(self):
+        # Sobe as threads na primeira chamada e recria as que morreram
+        with self._lock:
+            for i in range(self.size):
+                if i < len(self._threads) and self._threads[i].is_alive():
+                    continue
+                t = threading.Thread(target=self._worker, name=f"browser-pool-{i}", daemon=True)
+                self._alive += 1
+                t.start()
+                if i < len(self._threads):
+                    self._threads[i] = t
+                    self._stats["worker_restarts"] += 1
+                else:
+                    self._threads.append(t)
+
+    def _bump(self, key: str, delta: int = 1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+        data["size"] = self.size
+        data["queued"] = self._jobs.qsize()
+        data["max_jobs"] = self.max_jobs
+        data["max_rss_mb"] = self.max_rss_mb
+        with self._lock:
+            drivers = set(self._drivers.values())
+        data["rss_mb"] = round(_tree_rss_mb(drivers), 1)
+        data["alive"] = self._alive
+        data["last_error"] = self._last_error
+        return data
+
+    def run(self, fn, **context_options):
+        self._ensure_started()
+        fut = Future()
+        self._jobs.put((fn, context_options, fut))
+        try:
+            return fut.result(timeout=self.timeout)
+        except FuturesTimeoutError:
+            fut.cancel()  # se ainda estiver na fila, a thread descarta
+            raise RuntimeError(f"Pool de navegadores não respondeu em {self.timeout:g}s")
+
+    def _worker(self):
+        try:
+            self._serve()
+        except BaseException as e:
+            # Falha ao subir o Playwright (p.ex. navegador ausente) ou fora de um job:
+            # sem nenhuma outra thread viva, ninguém atenderia a fila — falha os pendentes
+            with self._lock:
+                self._stats["errors"] += 1
+                self._last_error = f"{type(e).__name__}: {e}"
+                self._alive -= 1
+                others = self._alive > 0
+            if not others:
+                self._fail_pending(e)
+
+    def _fail_pending(self, exc: BaseException):
+        while True:
+            try:
+                _, _, fut = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            if fut.set_running_or_notify_cancel():
+                fut.set_exception(RuntimeError(f"Pool de navegadores indisponível: {exc}"))
+
+    def _start_playwright(self):
+        # O driver (node) é filho direto deste processo e o Chromium é filho dele:
+        # a árvore do driver é exatamente o navegador desta thread
+        with _driver_start_lock:
+            before = _playwright_drivers()
+            p = sync_playwright().start()
+            new = _playwright_drivers() - before
+        if len(new) == 1:
+            with self._lock:
+                self._drivers[threading.current_thread()] = new.pop()
+        return p
+
+    def _rss_over_limit(self) -> bool:
+        with self._lock:
+            driver = self._drivers.get(threading.current_thread())
+        return driver is not None and _tree_rss_mb([driver]) > self.max_rss_mb
+
+    def _serve(self):
+        p = self._start_playwright()
+        try:
+            self._serve_loop(p)
+        finally:
+            with self._lock:
+                self._drivers.pop(threading.current_thread(), None)
+            p.stop()
+
+    def _serve_loop(self, p):
+        browser = None
+        served = 0
+        rss_checked = time.monotonic()
+        while True:
+            fn, context_options, fut = self._jobs.get()
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                # RSS medido por amostragem (varrer /proc a cada job sai caro)
+                rss_due = self.max_rss_mb > 0 and time.monotonic() - rss_checked >= BROWSER_RSS_CHECK_S
+                if rss_due:
+                    rss_checked = time.monotonic()
+                recycle = browser is not None and (
+                    served >= self.max_jobs
+                    or not browser.is_connected()
+                    or (rss_due and self._rss_over_limit())
+                )
+                if recycle:
+                    try:
+                        browser.close()
+                    except Exception:
+                        pass
+                    browser = None
+                    self._bump("recycles")
+                if browser is None:
+                    browser = _launch_chromium(p)
+                    served = 0
+                    self._bump("launches")
+                served += 1
+                ctx = browser.new_context(**context_options)
+                self._bump("contexts_in_use")
+                try:
+                    result = fn(ctx)
+                finally:
+                    try:
+                        ctx.close()
+                    except Exception:
+                        pass
+                    self._bump("contexts_in_use", -1)
+                self._bump("jobs")
+                fut.set_result(result)
+            except BaseException as e:
+                self._bump("errors")
+                fut.set_exception(e)
+
+
+browser_pool = BrowserPool(BROWSER_POOL_SIZE, BROWSER_MAX_JOBS, BROWSER_MAX_RSS_MB)
+# -----------------------------------------------------------------------------
+
+
+# ------------------------ Cache de tamanho de layout ------------------------
+# Guarda (w,h) medidos por hash do HTML + parâmetros de viewport, evitando a passada
+# de medição para templates já vistos.
+#   LAYOUT_CACHE_SIZE="256"  (entradas; 0 = desativa)
+LAYOUT_CACHE_SIZE = int(os.getenv("LAYOUT_CACHE_SIZE", "256"))
+_layout_cache = MemoryLRU(LAYOUT_CACHE_SIZE)
+
+_MEASURE_BODY_JS = """
+() => {
+  const b = document.body, d = document.documentElement;
+  const w = Math.max(b.scrollWidth, d.scrollWidth, b.offsetWidth, d.offsetWidth, d.clientWidth);
+  const h = Math.max(b.scrollHeight, d.scrollHeight, b.offsetHeight, d.offsetHeight, d.clientHeight);
+  return {w: Math.max(1, Math.floor(w)), h: Math.max(1, Math.floor(h))};
+}
+"""
+
+
+def _layout_cache_key(html_path: Path, *params) -> str | None:
+    if LAYOUT_CACHE_SIZE <= 0:
+        return None
+    try:
+        h = hashlib.sha256(html_path.read_bytes())
+    except Exception:
+        return None
+    h.update(repr(params).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _clamp_dims(w: int, h: int) -> tuple[int, int]:
+    w = max(1, int(w))
+    h = max(1, int(h))
+    if w > MAX_DIM or h > MAX_DIM:
+        r = min(MAX_DIM / w, MAX_DIM / h)
+        w, h = max(1, int(w * r)), max(1, int(h * r))
+    return w, h
+# -----------------------------------------------------------------------------
+
+
+def measure_body_size(html_path: Path) -> tuple[int, int]:
+    """Abre SEM gravação, mede o tamanho real do <body> e devolve (w,h)."""
+    cache_key = _layout_cache_key(html_path, "body", 1080, 1350)
+    cached = _layout_cache.get(cache_key)
+    if cached:
+        return cached
+
+    def _measure(ctx):
         page = ctx.new_page()
         page.goto(file_url(html_path), wait_until="load")
         if WAIT_NETWORK_IDLE:
@@ -1246,23 +3246,17 @@ def measure_body_size(html_path: Path) -> tuple[int, int]:
             page.wait_for_timeout(50)
         except Exception:
             pass
-        dims = page.evaluate(
-            """
-        () => {
-          const b = document.body, d = document.documentElement;
-          const w = Math.max(b.scrollWidth, d.scrollWidth, b.offsetWidth, d.offsetWidth, d.clientWidth);
-          const h = Math.max(b.scrollHeight, d.scrollHeight, b.offsetHeight, d.offsetHeight, d.clientHeight);
-          return {w, h};
-        }
-        """
-        )
-        ctx.close()
-        browser.close()
-    w = max(1, int(dims["w"]))
-    h = max(1, int(dims["h"]))
-    if w > MAX_DIM or h > MAX_DIM:
-        r = min(MAX_DIM / w, MAX_DIM / h)
-        w, h = max(1, int(w * r)), max(1, int(h * r))
+        return page.evaluate(_MEASURE_BODY_JS)
+
+    dims = browser_pool.run(
+        _measure,
+        viewport={"width": 1080, "height": 1350},
+        device_scale_factor=1.0,
+        java_script_enabled=True,
+        timezone_id=TIMEZONE_ID,
+    )
+    w, h = _clamp_dims(dims["w"], dims["h"])
+    _layout_cache.put(cache_key, (w, h))
     return w, h
 
 
@@ -1331,10 +3325,19 @@ def chromium_screenshot(
     media: str | None = None,
     css_inject: str | None = None,
 ) -> Path:
-    """Renderiza o HTML com Chromium/Playwright e retorna o caminho de um PNG temporário."""
+    """Renderiza o HTML com Chromium/Playwright e retorna o caminho de um PNG temporário.
+
+    Sem width/height (e AUTO_SIZE_BODY), mede o <body> e captura na MESMA sessão;
+    o tamanho medido fica em cache para o próximo render do mesmo HTML.
+    """
     # Determina tamanho de renderização
-    if AUTO_SIZE_BODY and (width is None or height is None):
-        w, h = measure_body_size(html_path)
+    auto_size = AUTO_SIZE_BODY and (width is None or height is None)
+    cache_key = None
+    measured = None
+    if auto_size:
+        cache_key = _layout_cache_key(html_path, "screenshot", media, dpr, css_inject)
+        measured = _layout_cache.get(cache_key)
+        w, h = measured or (1080, 1350)
     else:
         w = width or 1200
         h = height or 1350
@@ -1345,17 +3348,9 @@ def chromium_screenshot(
         tmp_png = Path(pth)
     else:
         tmp_png = Path(out_dir) / "_base_playwright.png"
-    with sync_playwright() as p:
-        try:
-            browser = p.chromium.launch(headless=True)
-        except Exception:
-            browser = p.chromium.launch(headless=True, args=['--no-sandbox'])  # Docker fallback
-        ctx = browser.new_context(
-            viewport={"width": w, "height": h},
-            device_scale_factor=dpr,
-            java_script_enabled=True,
-            timezone_id=TIMEZONE_ID,
-        )
+
+    def _capture(ctx):
+        nonlocal media
         page = ctx.new_page()
         page.goto(file_url(html_path), wait_until="load")
         prepare_page(page, zero_anim_delay=True)
@@ -1372,30 +3367,68 @@ def chromium_screenshot(
             page.emulate_media(media=media)
         except Exception:
             pass
-            try:
-                page.emulate_media(media=media)
-            except Exception:
-                pass
-        # Ajuste dinamicamente se mediu body
-        if AUTO_SIZE_BODY and (width is None or height is None):
-            dims = page.evaluate(
-                """
-                () => {
-                  const b = document.body, d = document.documentElement;
-                  const w = Math.max(b.scrollWidth, d.scrollWidth, b.offsetWidth, d.offsetWidth, d.clientWidth);
-                  const h = Math.max(b.scrollHeight, d.scrollHeight, b.offsetHeight, d.offsetHeight, d.clientHeight);
-                  return {w: Math.max(1, Math.floor(w)), h: Math.max(1, Math.floor(h))};
-                }
-                """
-            )
-            w = min(MAX_DIM, int(dims.get('w') or w))
-            h = min(MAX_DIM, int(dims.get('h') or h))
-            page.set_viewport_size({"width": w, "height": h})
+        # Mede o body na própria sessão (a menos que já esteja em cache)
+        dims = (w, h)
+        if auto_size and measured is None:
+            # Segunda medição no viewport final, pois o layout pode reagir ao resize
+            for _ in range(2):
+                d = page.evaluate(_MEASURE_BODY_JS)
+                nd = (min(MAX_DIM, int(d.get('w') or dims[0])), min(MAX_DIM, int(d.get('h') or dims[1])))
+                if nd == dims:
+                    break
+                dims = nd
+                page.set_viewport_size({"width": dims[0], "height": dims[1]})
         page.screenshot(path=str(tmp_png), full_page=bool(full_page), omit_background=bool(transparent))
-        ctx.close(); browser.close()
+        return dims
+
+    dims = browser_pool.run(
+        _capture,
+        viewport={"width": w, "height": h},
+        device_scale_factor=dpr,
+        java_script_enabled=True,
+        timezone_id=TIMEZONE_ID,
+    )
+    if auto_size and measured is None:
+        _layout_cache.put(cache_key, dims)
     return tmp_png
 
 
+# Registra (Date.now, ms) quando animações/transições começam a se mover e terminam
+# (ou são canceladas): eventos CSS + varredura de document.getAnimations() (cobre
+# element.animate()).
+_ANIM_TIMELINE_JS = """
+(() => {
+  const tl = window.__animTimeline = { starts: [], ends: [], infinite: false };
+  const isCss = (a) => (typeof CSSAnimation !== 'undefined' && a instanceof CSSAnimation)
+    || (typeof CSSTransition !== 'undefined' && a instanceof CSSTransition);
+  const onStart = () => tl.starts.push(Date.now());
+  const onEnd = () => tl.ends.push(Date.now());
+  addEventListener('animationstart', onStart, true);
+  addEventListener('transitionstart', onStart, true);
+  addEventListener('animationend', onEnd, true);
+  addEventListener('transitionend', onEnd, true);
+  addEventListener('animationcancel', onEnd, true);
+  addEventListener('transitioncancel', onEnd, true);
+  const seen = new WeakSet();
+  const poll = () => {
+    for (const a of (document.getAnimations ? document.getAnimations() : [])) {
+      if (seen.has(a)) continue;
+      const t = a.effect && a.effect.getComputedTiming ? a.effect.getComputedTiming() : null;
+      if (!t || t.progress === null) continue;  // ainda no delay
+      seen.add(a);
+      if (t.endTime === Infinity) tl.infinite = true;
+      if (!isCss(a)) {
+        onStart();
+        a.finished.then(onEnd, onEnd);  // rejeitada = cancelada
+      }
+    }
+    requestAnimationFrame(poll);
+  };
+  requestAnimationFrame(poll);
+})();
+"""
+
+
 def record_webm(
     html_path: Path,
     total_seconds: float,
@@ -1404,76 +3437,307 @@ def record_webm(
     out_dir: Path,
     *,
     zero_anim_delay: bool,
-) -> Path:
-    with sync_playwright() as p:
-        try:
-            browser = p.chromium.launch(headless=True)
-        except Exception:
-            browser = p.chromium.launch(headless=True, args=['--no-sandbox'])  # Docker fallback
-        ctx = browser.new_context(
-            viewport={"width": width, "height": height},
-            record_video_dir=str(out_dir),
-            record_video_size={"width": width, "height": height},
-            device_scale_factor=1.0,
-            java_script_enabled=True,
-            timezone_id=TIMEZONE_ID,
-        )
+) -> tuple[Path, dict | None, float]:
+    """Grava o HTML em tempo real. Retorna (webm, linha do tempo das animações, duração
+    gravada em s), onde a linha do tempo traz `starts`/`ends` em segundos relativos ao
+    início do vídeo.
+    """
+    def _record(ctx):
         page = ctx.new_page()
+        video_t0 = time.time()  # a gravação começa com a página
+        page.add_init_script(_ANIM_TIMELINE_JS)
         page.goto(file_url(html_path), wait_until="load")
         prepare_page(page, zero_anim_delay=zero_anim_delay)
         page.wait_for_timeout(500)  # warmup
         page.wait_for_timeout(int(total_seconds * 1000))
+        try:
+            raw = page.evaluate("window.__animTimeline || null")
+        except Exception:
+            raw = None
+        duration = time.time() - video_t0  # o vídeo vai da criação da página ao close
         page.close()
-        ctx.close()
-        browser.close()
+        if not raw:
+            return None, duration
+        return {
+            "starts": sorted(t / 1000.0 - video_t0 for t in raw.get("starts") or []),
+            "ends": sorted(t / 1000.0 - video_t0 for t in raw.get("ends") or []),
+            "infinite": bool(raw.get("infinite")),
+        }, duration
+
+    # O vídeo só é finalizado quando o contexto fecha (feito pelo pool ao fim do job)
+    timeline, duration = browser_pool.run(
+        _record,
+        viewport={"width": width, "height": height},
+        record_video_dir=str(out_dir),
+        record_video_size={"width": width, "height": height},
+        device_scale_factor=1.0,
+        java_script_enabled=True,
+        timezone_id=TIMEZONE_ID,
+    )
     vids = sorted(out_dir.rglob("*.webm"), key=lambda p: p.stat().st_mtime, reverse=True)
     if not vids:
         raise RuntimeError("Nenhum WEBM gravado.")
-    return vids[0]
+    return vids[0], timeline, duration
+
+
+# Controla o tempo das animações CSS/WAAPI: pausa cada animação ao vê-la pela primeira
+# vez e posiciona currentTime conforme o tempo virtual `t` (ms) desde o início da captura.
+_SEEK_ANIMATIONS_JS = """
+(t) => {
+  const born = window.__vtBorn || (window.__vtBorn = new WeakMap());
+  for (const a of document.getAnimations()) {
+    if (!born.has(a)) { born.set(a, t); a.pause(); }
+    a.currentTime = t - born.get(a);
+  }
+}
+"""
+
+
+class _StaticFrameTrimmer:
+    """Auto-trim para a captura quadro a quadro: como os quadros são determinísticos,
+    quadros estáticos têm bytes idênticos. Descarta o início estático (mantendo
+    `head_pad` quadros) e, se pedido, o final estático (mantendo `tail_pad` quadros),
+    guardando apenas o último quadro e contadores.
+    """
+
+    def __init__(self, emit, *, auto_head: bool, auto_tail: bool, head_pad: int, tail_pad: int):
+        self.emit = emit
+        self.auto_head = auto_head
+        self.auto_tail = auto_tail
+        self.head_pad = max(0, head_pad)
+        self.tail_pad = max(0, tail_pad)
+        self.prev = None
+        self.started = not auto_head
+        self.held = 0  # quadros iguais a `prev` ainda não emitidos
+        self.emitted = 0
+
+    def _emit(self, frame: bytes, times: int = 1):
+        for _ in range(times):
+            self.emit(frame)
+            self.emitted += 1
+
+    def feed(self, frame: bytes):
+        if self.prev is None:
+            self.prev = frame
+            if self.started:
+                self._emit(frame)
+            else:
+                self.held = 1
+            return
+        if frame == self.prev:
+            if self.started and not self.auto_tail:
+                self._emit(frame)
+            else:
+                self.held += 1
+            return
+        # Mudou: primeiro movimento (início) ou fim de um trecho parado
+        if not self.started:
+            self._emit(self.prev, min(self.held, self.head_pad))
+            self.started = True
+        else:
+            self._emit(self.prev, self.held)
+        self.held = 0
+        self.prev = frame
+        self._emit(frame)
+
+    def finish(self):
+        if self.prev is None:
+            return
+        if not self.started:
+            # Nenhum movimento detectado: mantém o vídeo inteiro (como compute_trim)
+            self._emit(self.prev, self.held)
+        else:
+            self._emit(self.prev, min(self.held, self.tail_pad))
+        self.held = 0
+
+
+def capture_frames_to_ffmpeg(
+    html_path: Path,
+    total_seconds: float,
+    width: int,
+    height: int,
+    fps: int,
+    output_args: list[str],
+    *,
+    zero_anim_delay: bool,
+    auto_head: bool = True,
+    auto_tail: bool = False,
+    head_pad: float = HEAD_PAD_S,
+    tail_pad: float = TAIL_PAD_S,
+):
+    """Captura determinística: avança o relógio da página e as animações quadro a quadro
+    (tempo virtual) e envia cada screenshot JPEG direto ao stdin do ffmpeg, que gera as
+    saídas finais (`output_args`) numa única passada (sem WEBM intermediário nem quadros
+    em disco).
+    """
+    n_frames = max(1, int(round(total_seconds * fps)))
+    frame_ms = 1000.0 / fps
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-f",
+        "image2pipe",
+        "-framerate",
+        str(fps),
+        "-c:v",
+        "mjpeg",
+        "-i",
+        "-",
+    ] + output_args
+
+    with tempfile.TemporaryFile() as ff_log:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=ff_log)
+        trimmer = _StaticFrameTrimmer(
+            proc.stdin.write,
+            auto_head=auto_head,
+            auto_tail=auto_tail,
+            head_pad=int(round(head_pad * fps)),
+            tail_pad=int(round(tail_pad * fps)),
+        )
+
+        def _capture(ctx):
+            page = ctx.new_page()
+            page.goto(file_url(html_path), wait_until="load")
+            prepare_page(page, zero_anim_delay=zero_anim_delay)
+            # Relógio falso (timers, Date, rAF) parado; só avança quando mandamos
+            clock = None
+            try:
+                t0 = int(time.time() * 1000)
+                page.clock.install(time=t0)
+                page.clock.pause_at(t0 + 100)
+                clock = page.clock
+            except Exception:
+                clock = None
+            for i in range(n_frames):
+                if i and clock is not None:
+                    # Passo inteiro em ms sem acumular erro de arredondamento
+                    clock.run_for(round(i * frame_ms) - round((i - 1) * frame_ms))
+                page.evaluate(_SEEK_ANIMATIONS_JS, i * frame_ms)
+                trimmer.feed(page.screenshot(type="jpeg", quality=FRAME_JPEG_QUALITY))
+            page.close()
 
+        try:
+            browser_pool.run(
+                _capture,
+                viewport={"width": width, "height": height},
+                device_scale_factor=1.0,
+                java_script_enabled=True,
+                timezone_id=TIMEZONE_ID,
+            )
+            trimmer.finish()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+        if proc.wait() != 0:
+            ff_log.seek(0)
+            tail = ff_log.read().decode("utf-8", errors="replace")[-2000:]
+            raise RuntimeError(f"ffmpeg falhou ao codificar os quadros: {tail}")
 
-def video_duration(path: Path) -> float:
-    out = subprocess.check_output(
+
+def video_duration(path: Path) -> float | None:
+    """Duração (s) declarada no container, sem decodificar; None se ausente."""
+    out = subprocess.run(
         [
             "ffprobe",
-            "-v",
-            "error",
-            "-show_entries",
-            "format=duration",
-            "-of",
-            "default=nokey=1:noprint_wrappers=1",
+            "-v", "error",
+            "-show_entries", "format=duration",
+            "-of", "csv=p=0",
             str(path),
-        ]
-    ).decode().strip()
+        ],
+        capture_output=True,
+        text=True,
+    ).stdout
     try:
-        return float(out)
-    except Exception:
-        return 0.0
+        dur = float(out.strip())
+    except ValueError:
+        return None
+    return dur if dur > 0 else None
 
 
-def detect_scene_changes(path: Path, threshold: float) -> list[float]:
-    cmd = [
-        "ffmpeg",
-        "-hide_banner",
+def analyze_scenes(
+    path: Path,
+    threshold: float,
+    *,
+    stop_at_first: bool = False,
+    offset: float = 0.0,
+) -> tuple[float, list[float]]:
+    """Lê o vídeo UMA vez, em quadros reduzidos (ANALYSIS_WIDTH px), e devolve
+    (duração, tempos de mudança de cena acima de `threshold`).
+
+    Com `stop_at_first`, interrompe a decodificação na primeira mudança (basta para
+    o auto-trim do início); nesse caso a duração retornada é parcial. `offset`
+    começa a leitura nesse ponto (seek antes do -i); os tempos continuam absolutos.
+    """
+    cmd = ["ffmpeg", "-hide_banner", "-nostats"]
+    if offset > 0:
+        cmd += ["-ss", f"{offset}"]
+    cmd += [
         "-i",
         str(path),
-        "-filter:v",
-        f"select='gt(scene,{threshold})',showinfo",
         "-an",
+        "-vf",
+        f"scale={ANALYSIS_WIDTH}:-2,select='gte(scene,0)',metadata=print:key=lavfi.scene_score",
         "-f",
         "null",
         "-",
     ]
-    proc = subprocess.run(cmd, capture_output=True, text=True)
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
     times = []
-    for line in proc.stderr.splitlines():
-        m = re.search(r"pts_time:([0-9]+\.[0-9]+)", line)
-        if m:
-            try:
-                times.append(float(m.group(1)))
-            except Exception:
-                pass
-    return times
+    pts = []
+    cur = None
+    try:
+        for line in proc.stderr:
+            m = re.search(r"pts_time:([0-9.]+)", line)
+            if m:
+                cur = float(m.group(1)) + offset
+                pts.append(cur)
+                continue
+            m = re.search(r"lavfi\.scene_score=([0-9.]+)", line)
+            if m and cur is not None and float(m.group(1)) > threshold:
+                times.append(cur)
+                if stop_at_first:
+                    break
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+    dur = 0.0
+    if pts:
+        step = pts[-1] - pts[-2] if len(pts) > 1 else 0.0
+        dur = pts[-1] + max(0.0, step)
+    return dur, times
+
+
+def trim_from_timeline(
+    timeline: dict | None,
+    *,
+    auto_head=True,
+    auto_tail=False,
+    head_pad=0.05,
+    tail_pad=0.10,
+) -> tuple[float, float | None] | None:
+    """Corte a partir da linha do tempo das animações registrada na captura.
+    Retorna None se ela não basta para o corte pedido (cai na detecção de cena).
+    """
+    if not (auto_head or auto_tail):
+        return 0.0, None
+    if not timeline or not timeline.get("starts"):
+        return None
+    start = max(0.0, timeline["starts"][0] - head_pad) if auto_head else 0.0
+    if not auto_tail:
+        return start, None
+    # Só confia no fim se todo início tem um fim/cancelamento registrado; senão há
+    # animação ainda rodando ao fim da captura
+    if timeline.get("infinite") or len(timeline.get("ends") or []) < len(timeline["starts"]):
+        return None
+    end = max(timeline["ends"][-1], timeline["starts"][-1]) + tail_pad
+    return start, max(0.01, end - start)
 
 
 def compute_trim(
@@ -1484,27 +3748,51 @@ def compute_trim(
     head_pad=0.05,
     tail_pad=0.10,
     scene_threshold: float = SCENE_THRESHOLD,
-) -> tuple[float, float]:
-    dur = max(0.01, video_duration(webm))
+    duration: float | None = None,
+) -> tuple[float, float | None]:
+    """Retorna (início, duração) do trecho a manter; duração None = até o fim.
+
+    O início sai da primeira mudança de cena (leitura interrompida nela). O final
+    é procurado só numa janela ao fim do vídeo (TAIL_ANALYSIS_S, dobrando até
+    achar uma mudança), com seek a partir de `duration` — a duração conhecida da
+    captura; sem ela, a do container (ffprobe).
+    """
     if not (auto_head or auto_tail):
-        return 0.0, dur
-    sc = detect_scene_changes(webm, scene_threshold)
-    if not sc:
-        return 0.0, dur
-    start = max(0.0, sc[0] - head_pad) if auto_head else 0.0
-    if auto_tail:
-        end = min(dur, sc[-1] + tail_pad)
-        take = max(0.01, end - start)
+        return 0.0, None
+    _, head = analyze_scenes(webm, scene_threshold, stop_at_first=True)
+    if not head:
+        return 0.0, None
+    first = head[0]
+    start = max(0.0, first - head_pad) if auto_head else 0.0
+    if not auto_tail:
+        return start, None
+
+    dur = duration or video_duration(webm)
+    if dur is None:
+        # Sem duração no container: não há onde fazer o seek, lê o vídeo inteiro
+        dur, sc = analyze_scenes(webm, scene_threshold)
+        last = sc[-1] if sc else first
     else:
-        take = max(0.01, dur - start)
-    return start, take
+        last = first
+        janela = TAIL_ANALYSIS_S
+        while True:
+            inicio = max(first, dur - janela)
+            _, sc = analyze_scenes(webm, scene_threshold, offset=inicio)
+            if sc:
+                last = max(last, sc[-1])
+                break
+            if inicio <= first:
+                break
+            janela *= 2
+    end = min(dur, last + tail_pad)
+    return start, max(0.01, end - start)
 
 
 def webm_to_mp4_precise(
     webm_path: Path,
     mp4_path: Path,
     start: float,
-    take: float,
+    take: float | None,
     out_w: int,
     out_h: int,
     fps: int,
@@ -1518,8 +3806,10 @@ def webm_to_mp4_precise(
         str(webm_path),
         "-ss",
         f"{start}",
-        "-t",
-        f"{take}",
+    ]
+    if take is not None:
+        cmd += ["-t", f"{take}"]
+    cmd += [
         "-vf",
         vf_chain,
         "-c:v",
@@ -1537,9 +3827,207 @@ def webm_to_mp4_precise(
         "-movflags",
         "+faststart",
         "-an",
-        str(mp4_path),
+        str(mp4_path),
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def webm_keyframes(path: Path) -> list[float]:
+    """Tempos (s) dos keyframes do vídeo, lidos só dos pacotes-chave (sem decodificar o resto)."""
+    out = subprocess.run(
+        [
+            "ffprobe",
+            "-v", "error",
+            "-select_streams", "v:0",
+            "-skip_frame", "nokey",
+            "-show_entries", "frame=pts_time",
+            "-of", "csv=p=0",
+            str(path),
+        ],
+        capture_output=True,
+        text=True,
+    ).stdout
+    times = []
+    for line in out.splitlines():
+        try:
+            times.append(float(line.strip().strip(",")))
+        except ValueError:
+            pass
+    return sorted(times)
+
+
+def webm_trim_copy(webm: Path, out_path: Path, start: float, take: float | None, *, tolerance: float = 0.04) -> Path:
+    """Corta o WEBM capturado sem recodificar (stream copy) quando o início cai num
+    keyframe; senão recodifica (VP8, rápido) só o trecho até o próximo keyframe e
+    concatena o restante copiado.
+    """
+    end = None if take is None else start + take
+    keys = webm_keyframes(webm)
+
+    def _copy(src_start: float, dst: Path, dur: float | None):
+        cmd = ["ffmpeg", "-y", "-ss", f"{src_start}", "-i", str(webm)]
+        if dur is not None:
+            cmd += ["-t", f"{dur}"]
+        subprocess.run(cmd + ["-c", "copy", "-an", str(dst)], check=True, capture_output=True)
+
+    def _reencode(src_start: float, dst: Path, dur: float | None):
+        cmd = ["ffmpeg", "-y", "-ss", f"{src_start}", "-i", str(webm)]
+        if dur is not None:
+            cmd += ["-t", f"{dur}"]
+        cmd += [
+            "-c:v", "libvpx",
+            "-deadline", "realtime",
+            "-cpu-used", "8",
+            "-crf", "10",
+            "-b:v", "4M",
+            "-an",
+            str(dst),
+        ]
+        subprocess.run(cmd, check=True, capture_output=True)
+
+    # Início já alinhado a um keyframe: só cópia
+    if start <= tolerance or any(abs(k - start) <= tolerance for k in keys):
+        kf = 0.0 if start <= tolerance else min(keys, key=lambda k: abs(k - start))
+        _copy(kf, out_path, None if end is None else end - kf)
+        return out_path
+
+    nxt = next((k for k in keys if k > start), None)
+    if nxt is None or (end is not None and nxt >= end):
+        # Nenhum keyframe dentro do trecho: recodifica o trecho todo (ainda sem libx264)
+        _reencode(start, out_path, take)
+        return out_path
+
+    head = out_path.with_name(f"{out_path.stem}_head.webm")
+    rest = out_path.with_name(f"{out_path.stem}_rest.webm")
+    lst = out_path.with_name(f"{out_path.stem}_concat.txt")
+    try:
+        _reencode(start, head, nxt - start)
+        _copy(nxt, rest, None if end is None else end - nxt)
+        lst.write_text(f"file '{head.as_posix()}'\nfile '{rest.as_posix()}'\n", encoding="utf-8")
+        subprocess.run(
+            ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(lst), "-c", "copy", str(out_path)],
+            check=True,
+            capture_output=True,
+        )
+    finally:
+        for f in (head, rest, lst):
+            f.unlink(missing_ok=True)
+    return out_path
+
+
+def _h264_args(crf: int = CRF) -> list[str]:
+    return [
+        "-c:v", "libx264",
+        "-pix_fmt", PIX_FMT,
+        "-profile:v", PROFILE,
+        "-level:v", LEVEL,
+        "-preset", PRESET,
+        "-crf", str(crf),
+        "-movflags", "+faststart",
+        "-an",
     ]
-    subprocess.run(cmd, check=True)
+
+
+def _vp9_args(crf: int = CRF) -> list[str]:
+    return [
+        "-c:v", "libvpx-vp9",
+        "-pix_fmt", PIX_FMT,
+        "-b:v", "0",
+        "-crf", str(crf),
+        "-deadline", "good",
+        "-cpu-used", "4",
+        "-row-mt", "1",
+        "-an",
+    ]
+
+
+def rendition_output_args(renditions: list[dict], posters: list[dict], out_dir: Path) -> tuple[list[str], list[Path]]:
+    """Monta as saídas do ffmpeg para várias renditions + posters a partir de UMA entrada
+    (split + scale num único filter graph). Retorna (args após o -i, arquivos gerados).
+    """
+    n = len(renditions) + len(posters)
+    graph = [f"[0:v]split={n}" + "".join(f"[s{i}]" for i in range(n))]
+    args = []
+    outputs = []
+    for i, rd in enumerate(renditions):
+        w, h = rd["width"], rd["height"]
+        graph.append(
+            f"[s{i}]fps={rd['fps']},"
+            f"scale={w}:{h}:force_original_aspect_ratio=decrease:flags=lanczos,"
+            f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1[o{i}]"
+        )
+        ext = rd["container"]
+        path = out_dir / f"{i + 1:02d}_{w}x{h}_{rd['fps']}fps.{ext}"
+        codec = _vp9_args(rd["crf"]) if ext == "webm" else _h264_args(rd["crf"])
+        args += ["-map", f"[o{i}]"] + codec + [str(path)]
+        outputs.append(path)
+    for j, ps in enumerate(posters):
+        k = len(renditions) + j
+        chain = f"[s{k}]select='gte(t,{ps['time']})'"
+        if ps.get("width") or ps.get("height"):
+            chain += f",scale={ps.get('width') or -2}:{ps.get('height') or -2}:flags=lanczos"
+        graph.append(chain + f"[o{k}]")
+        # qualidade 1-100 → -q:v 31..2 do mjpeg
+        q = max(2, min(31, round(31 - (ps["quality"] / 100.0) * 29)))
+        path = out_dir / f"poster_{j + 1:02d}.jpg"
+        args += ["-map", f"[o{k}]", "-frames:v", "1", "-q:v", str(q), "-update", "1", str(path)]
+        outputs.append(path)
+    return ["-filter_complex", ";".join(graph)] + args, outputs
+
+
+def _parse_renditions(raw) -> list[dict]:
+    if not raw:
+        return []
+    items = json.loads(raw) if isinstance(raw, str) else raw
+    if not isinstance(items, list) or len(items) > 8:
+        raise ValueError("renditions deve ser uma lista JSON com até 8 itens")
+    out = []
+    for it in items:
+        if not isinstance(it, dict):
+            raise ValueError("cada rendition deve ser um objeto")
+        container = str(it.get("container") or "mp4").lower()
+        if container not in ("mp4", "webm"):
+            raise ValueError("container deve ser mp4 ou webm")
+        try:
+            rd = {
+                "width": int(it["width"]) if it.get("width") else None,
+                "height": int(it["height"]) if it.get("height") else None,
+                "fps": int(it["fps"]) if it.get("fps") else None,
+                "crf": int(it.get("crf", CRF)),
+                "container": container,
+            }
+        except (TypeError, ValueError):
+            raise ValueError("width/height/fps/crf da rendition devem ser inteiros")
+        if not (0 <= rd["crf"] <= 51):
+            raise ValueError("crf deve estar entre 0 e 51")
+        out.append(rd)
+    return out
+
+
+def _parse_posters(raw) -> list[dict]:
+    if not raw:
+        return []
+    if isinstance(raw, str):
+        raw = raw.strip()
+        items = json.loads(raw) if raw.startswith("[") else [x for x in raw.split(",") if x.strip()]
+    else:
+        items = raw
+    if not isinstance(items, list) or len(items) > 16:
+        raise ValueError("posters deve ser uma lista com até 16 itens")
+    out = []
+    for it in items:
+        spec = it if isinstance(it, dict) else {"time": it}
+        try:
+            ps = {
+                "time": max(0.0, float(spec.get("time", 0))),
+                "width": int(spec["width"]) if spec.get("width") else None,
+                "height": int(spec["height"]) if spec.get("height") else None,
+                "quality": max(1, min(100, int(spec.get("quality", 90)))),
+            }
+        except (TypeError, ValueError):
+            raise ValueError("poster inválido (use segundos ou {time, width, height, quality})")
+        out.append(ps)
+    return out
 
 
 def write_temp_html(tmpdir: Path, *, html_text: str = None, html_file=None) -> Path:
@@ -1565,6 +4053,19 @@ def health():
     return {"ok": True}
 
 
+@app.route("/stats")
+def stats():
+    """Métricas internas para dimensionamento (pool de navegadores etc.)."""
+    return {
+        "browser_pool": browser_pool.stats(),
+        "layout_cache": _layout_cache.stats(),
+        "remote_cache": remote_cache_stats(),
+        "placeholder_index": _placeholder_index.stats(),
+        "render_jobs": render_jobs.stats(),
+        "text_cache": text_cache_stats(),
+    }
+
+
 def _needs_modern_renderer(html_path: Path) -> bool:
     """Heurística: detecta uso de CSS moderno (grid/flex) e outras pistas.
     Se encontrar, priorizamos Chromium para fidelidade.
@@ -1601,6 +4102,7 @@ def html_para_imagem():
       - quality: qualidade para JPEG/WEBP (1-100)
       - transparent: 1/true para fundo transparente (apenas PNG)
       - filename: nome do arquivo de saída (opcional)
+      - auto_trim: 1/true para remover bordas em branco (todos os lados)
 
     Resposta: imagem (attachment)
     """
@@ -1726,6 +4228,18 @@ def html_para_imagem():
                     """
                 )
 
+                # CSS de ajustes finos (safe_layout/css) vai na MESMA passada, antes da captura
+                css_payload = font_fallback_css
+                if safe_layout:
+                    css_payload += """
+                    * { animation: none !important; transition: none !important; }
+                    img { display:block; }
+                    .hero { padding-bottom: calc(var(--hero-pad) + 16px) !important; }
+                    .legend { inset: auto 10px 0 auto !important; }
+                    """
+                if extra_css:
+                    css_payload += str(extra_css)
+
                 base_png = chromium_screenshot(
                     html_path,
                     width=width,
@@ -1734,40 +4248,8 @@ def html_para_imagem():
                     dpr=dpr,
                     full_page=full_page,
                     media=media,
-                    css_inject=font_fallback_css,
+                    css_inject=css_payload,
                 )
-                # Injeta CSS após carregamento para ajustes finos (quando solicitado)
-                if safe_layout or extra_css:
-                    with sync_playwright() as p:
-                        try:
-                            browser = p.chromium.launch(headless=True)
-                        except Exception:
-                            browser = p.chromium.launch(headless=True, args=['--no-sandbox'])
-                        ctx = browser.new_context(viewport={"width": width or 1080, "height": height or 1350}, device_scale_factor=dpr)
-                        page = ctx.new_page()
-                        page.goto(file_url(html_path), wait_until="load")
-                        prepare_page(page, zero_anim_delay=True)
-                        if media in ("screen", "print"):
-                            try:
-                                page.emulate_media(media=media)
-                            except Exception:
-                                pass
-                        css_payload = ""
-                        if safe_layout:
-                            css_payload += """
-                            * { animation: none !important; transition: none !important; }
-                            img { display:block; }
-                            .hero { padding-bottom: calc(var(--hero-pad) + 16px) !important; }
-                            .legend { inset: auto 10px 0 auto !important; }
-                            """
-                        if extra_css:
-                            css_payload += str(extra_css)
-                        if css_payload.strip():
-                            page.add_style_tag(content=css_payload)
-                        # Re-tira o screenshot com CSS aplicado
-                        base_png = Path(tempfile.mkstemp(suffix=".png")[1])
-                        page.screenshot(path=str(base_png), full_page=full_page, omit_background=bool(transparent))
-                        ctx.close(); browser.close()
                 if wait_ms:
                     time.sleep(wait_ms/1000.0)
 
@@ -1852,7 +4334,7 @@ def html_para_imagem():
                     page = doc[0]
                     # renderizar em boa resolução; ajusta conforme necessário
                     pix = page.get_pixmap(dpi=200)
-                    img = Image.open(BytesIO(pix.tobytes("png")))
+                    img = pixmap_to_image(pix)
                     save_params = {}
                     if fmt == 'jpeg':
                         img = img.convert('RGB')
@@ -1926,9 +4408,14 @@ def html_para_imagem():
                 pass
             return (255, 255, 255)
 
-        if out_w or out_h:
+        # auto_trim=1: remove bordas em branco (todos os lados) antes do ajuste final
+        auto_trim = str(request.form.get('auto_trim', '0')).lower() in ('1', 'true', 't', 'yes', 'y')
+
+        if out_w or out_h or auto_trim:
             try:
                 img = Image.open(str(out_path))
+                if auto_trim:
+                    img = trim_blank(img)
                 src_w, src_h = img.size
                 tw = int(out_w) if out_w else None
                 th = int(out_h) if out_h else None
@@ -1942,7 +4429,7 @@ def html_para_imagem():
                     scale = th / src_h
                     nw, nh = max(1, int(round(src_w * scale))), max(1, int(round(src_h * scale)))
                     img = img.resize((nw, nh), Image.LANCZOS)
-                else:
+                elif tw and th:
                     # Ambos informados: aplicar modo de ajuste
                     tw = max(1, int(tw or src_w))
                     th = max(1, int(th or src_h))
@@ -2099,57 +4586,33 @@ def html_para_pdf():
         return jsonify({"error": f"Falha ao converter HTML em PDF: {str(e)}"}), 500
 
 
-@app.route("/render", methods=["POST"])
-def render():
-    """
-    POST /render
-    Form-data:
-      - file: arquivo .html  (opcional se mandar 'html')
-      - html: texto bruto do HTML (opcional se mandar 'file')
-      - content_seconds (float, opcional) | default CONTENT_SECONDS
-      - width,height (int, opcionais) | se omitidos e AUTO_SIZE_BODY=True → usa tamanho do <body>
-      - target_fps (int, opcional) | default TARGET_FPS
-      - auto_trim_head (bool), auto_trim_tail (bool) [0/1, true/false]
-      - zero_anim_delay (bool)
-      - scene_threshold, head_pad, tail_pad (opcionais)
-    Resposta: video/mp4 (attachment)
-    """
-    try:
-        ensure_ffmpeg()
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    html_file = request.files.get("file")
-    html_text = request.form.get("html")
-    if not html_file and not html_text:
-        return jsonify({"error": "Envie 'file' (multipart) OU 'html' (texto)."}), 400
-
-    # parâmetros opcionais
+def _parse_render_options(form) -> dict:
+    """Lê os parâmetros de /render do form. Levanta ValueError com a mensagem de erro."""
     try:
-        content_seconds = float(request.form.get("content_seconds", CONTENT_SECONDS))
+        content_seconds = float(form.get("content_seconds", CONTENT_SECONDS))
     except ValueError:
-        return jsonify({"error": "content_seconds inválido"}), 400
+        raise ValueError("content_seconds inválido")
     try:
-        target_fps = int(request.form.get("target_fps", TARGET_FPS))
+        target_fps = int(form.get("target_fps", TARGET_FPS))
     except ValueError:
-        return jsonify({"error": "target_fps inválido"}), 400
+        raise ValueError("target_fps inválido")
 
     auto_trim_head = (
-        str(request.form.get("auto_trim_head", str(AUTO_TRIM_HEAD))).lower()
+        str(form.get("auto_trim_head", str(AUTO_TRIM_HEAD))).lower()
         in ("1", "true", "t", "yes", "y")
     )
     auto_trim_tail = (
-        str(request.form.get("auto_trim_tail", str(AUTO_TRIM_TAIL))).lower()
+        str(form.get("auto_trim_tail", str(AUTO_TRIM_TAIL))).lower()
         in ("1", "true", "t", "yes", "y")
     )
     zero_anim_delay = (
-        str(request.form.get("zero_anim_delay", str(ZERO_ANIM_DELAY))).lower()
+        str(form.get("zero_anim_delay", str(ZERO_ANIM_DELAY))).lower()
         in ("1", "true", "t", "yes", "y")
     )
 
-    scene_threshold = request.form.get("scene_threshold")
-    head_pad = request.form.get("head_pad")
-    tail_pad = request.form.get("tail_pad")
+    scene_threshold = form.get("scene_threshold")
+    head_pad = form.get("head_pad")
+    tail_pad = form.get("tail_pad")
     try:
         scene_threshold = (
             float(scene_threshold) if scene_threshold is not None else SCENE_THRESHOLD
@@ -2157,15 +4620,458 @@ def render():
         head_pad = float(head_pad) if head_pad is not None else HEAD_PAD_S
         tail_pad = float(tail_pad) if tail_pad is not None else TAIL_PAD_S
     except ValueError:
-        return jsonify({"error": "scene_threshold/head_pad/tail_pad inválidos"}), 400
+        raise ValueError("scene_threshold/head_pad/tail_pad inválidos")
 
-    width = request.form.get("width")
-    height = request.form.get("height")
+    width = form.get("width")
+    height = form.get("height")
     try:
         width = int(width) if width else None
         height = int(height) if height else None
     except ValueError:
-        return jsonify({"error": "width/height inválidos"}), 400
+        raise ValueError("width/height inválidos")
+
+    capture = str(form.get("capture") or CAPTURE_MODE).lower()
+    if capture == "virtual":
+        capture = "frames"
+    if capture not in ("realtime", "frames"):
+        raise ValueError("capture deve ser 'realtime' ou 'frames'")
+    if capture == "frames" and not (1 <= target_fps <= 120):
+        raise ValueError("target_fps deve estar entre 1 e 120 no modo frames")
+
+    trim_source = str(form.get("trim_source") or "auto").lower()
+    if trim_source not in ("auto", "timeline", "scene"):
+        raise ValueError("trim_source deve ser 'auto', 'timeline' ou 'scene'")
+
+    try:
+        renditions = _parse_renditions(form.get("renditions"))
+        posters = _parse_posters(form.get("posters"))
+    except json.JSONDecodeError:
+        raise ValueError("renditions/posters devem ser JSON válido")
+
+    output = str(form.get("output") or "mp4").lower()
+    if output not in ("mp4", "webm"):
+        raise ValueError("output deve ser 'mp4' ou 'webm'")
+
+    return {
+        "capture": capture,
+        "trim_source": trim_source,
+        "output": output,
+        "renditions": renditions,
+        "posters": posters,
+        "content_seconds": content_seconds,
+        "target_fps": target_fps,
+        "auto_trim_head": auto_trim_head,
+        "auto_trim_tail": auto_trim_tail,
+        "zero_anim_delay": zero_anim_delay,
+        "scene_threshold": scene_threshold,
+        "head_pad": head_pad,
+        "tail_pad": tail_pad,
+        "width": width,
+        "height": height,
+    }
+
+
+def run_render(html_path: Path, opts: dict, workdir: Path) -> tuple[Path, str, str]:
+    """Pipeline completo HTML → vídeo em `workdir`.
+
+    Retorna (arquivo, mimetype, nome de download): o MP4, ou um ZIP quando a
+    requisição pede várias renditions/posters (todas da MESMA captura).
+    """
+    width, height = opts["width"], opts["height"]
+
+    # 1) descobrir tamanho
+    if AUTO_SIZE_BODY and (width is None or height is None):
+        w, h = measure_body_size(html_path)
+    else:
+        w = width or 1080
+        h = height or 1350
+
+    output = opts.get("output", "mp4")
+    mp4_path = workdir / f"output.{output}"
+    multi = bool(opts.get("renditions") or opts.get("posters"))
+    if multi:
+        renditions = [
+            {
+                **rd,
+                # yuv420p exige dimensões pares
+                "width": (rd["width"] or w) // 2 * 2,
+                "height": (rd["height"] or h) // 2 * 2,
+                "fps": rd["fps"] or opts["target_fps"],
+            }
+            for rd in opts.get("renditions") or []
+        ]
+        out_dir = workdir / "renditions"
+        out_dir.mkdir(exist_ok=True)
+        output_args, outputs = rendition_output_args(renditions, opts.get("posters") or [], out_dir)
+    else:
+        codec = _vp9_args() if output == "webm" else _h264_args()
+        output_args, outputs = codec + [str(mp4_path)], [mp4_path]
+
+    # Quadro a quadro: quadros vão direto para o ffmpeg, já com auto-trim
+    if opts.get("capture") == "frames":
+        # Sem atraso de início de gravação: não precisa do buffer inicial
+        total = opts["content_seconds"] + BUFFER_TAIL_S
+        capture_frames_to_ffmpeg(
+            html_path, total, w, h, opts["target_fps"], output_args,
+            zero_anim_delay=opts["zero_anim_delay"],
+            auto_head=opts["auto_trim_head"],
+            auto_tail=opts["auto_trim_tail"],
+            head_pad=opts["head_pad"],
+            tail_pad=opts["tail_pad"],
+        )
+    else:
+        # 2) gravar WEBM com buffers
+        total = opts["content_seconds"] + BUFFER_HEAD_S + BUFFER_TAIL_S
+        video, timeline, duration = record_webm(
+            html_path, total, w, h, workdir, zero_anim_delay=opts["zero_anim_delay"]
+        )
+
+        # 3) auto-trim do início (e opcional do final), SEM cortar conteúdo:
+        #    pela linha do tempo das animações; detecção de cena como fallback
+        trim = None
+        if opts.get("trim_source", "auto") in ("auto", "timeline"):
+            trim = trim_from_timeline(
+                timeline,
+                auto_head=opts["auto_trim_head"],
+                auto_tail=opts["auto_trim_tail"],
+                head_pad=opts["head_pad"],
+                tail_pad=opts["tail_pad"],
+            )
+        if trim is None:
+            trim = compute_trim(
+                video,
+                auto_head=opts["auto_trim_head"],
+                auto_tail=opts["auto_trim_tail"],
+                head_pad=opts["head_pad"],
+                tail_pad=opts["tail_pad"],
+                scene_threshold=opts["scene_threshold"],
+                duration=duration,
+            )
+        start, take = trim
+
+        # 4) codificar: MP4 com seek preciso (sem barras) ou todas as renditions de uma vez
+        if multi:
+            cmd = ["ffmpeg", "-y", "-ss", f"{start}"]
+            if take is not None:
+                cmd += ["-t", f"{take}"]
+            subprocess.run(cmd + ["-i", str(video)] + output_args, check=True)
+        elif output == "webm":
+            # Passthrough: devolve o próprio WEBM capturado, cortado por stream copy
+            webm_trim_copy(video, mp4_path, start, take)
+        else:
+            webm_to_mp4_precise(video, mp4_path, start, take, w, h, opts["target_fps"])
+
+    if not multi:
+        return mp4_path, f"video/{output}", f"render.{output}"
+    zip_path = workdir / "render.zip"
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED) as zf:
+        for f in outputs:
+            if f.exists():
+                zf.write(f, arcname=f.name)
+    return zip_path, "application/zip", "render.zip"
+
+
+# ------------------------ Fila de jobs assíncronos de /render ------------------------
+# Jobs ficam em disco (sobrevivem a restart): cada job tem um diretório com job.json,
+# o HTML de entrada e, ao final, output.mp4.
+#   RENDER_JOBS_DIR="/tmp/gerador_cache/render_jobs"
+#   RENDER_JOB_WORKERS="2"      (renders simultâneos)
+#   RENDER_JOB_MAX_QUEUE="50"   (jobs pendentes aceitos; acima disso responde 503)
+#   RENDER_JOB_TTL_S="3600"     (tempo de retenção de jobs finalizados)
+RENDER_JOBS_DIR = os.getenv("RENDER_JOBS_DIR", os.path.join(tempfile.gettempdir(), "gerador_cache", "render_jobs"))
+RENDER_JOB_WORKERS = max(1, int(os.getenv("RENDER_JOB_WORKERS", "2")))
+RENDER_JOB_MAX_QUEUE = max(1, int(os.getenv("RENDER_JOB_MAX_QUEUE", "50")))
+RENDER_JOB_TTL_S = float(os.getenv("RENDER_JOB_TTL_S", "3600"))
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class RenderJobStore:
+    """Fila persistente de renders executada por um pool de threads.
+
+    Cada processo segura um lock de arquivo (flock) enquanto vive e marca os jobs
+    que executa com esse dono; na subida, só são retomados jobs cujo dono morreu,
+    o que permite vários workers WSGI no mesmo diretório.
+    """
+
+    _ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+    def __init__(self, directory: str, workers: int, max_queue: int, ttl_s: float):
+        self.directory = Path(directory)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._running = 0
+        self._last_sweep = 0.0
+        self._stats = {"submitted": 0, "done": 0, "failed": 0}
+        self._owner = uuid.uuid4().hex
+        self._owner_fh = None
+
+    # --- donos (processos) ---
+    def _owners_dir(self) -> Path:
+        return self.directory / ".owners"
+
+    def _hold_owner_lock(self):
+        self._owners_dir().mkdir(parents=True, exist_ok=True)
+        self._owner_fh = open(self._owners_dir() / f"{self._owner}.lock", "w")
+        if fcntl is not None:
+            fcntl.flock(self._owner_fh, fcntl.LOCK_EX)
+
+    def _owner_alive(self, owner: str | None) -> bool:
+        if not owner or not self._ID_RE.match(owner):
+            return False
+        if owner == self._owner:
+            return True
+        if fcntl is None:
+            return False  # sem flock: assume processo único
+        path = self._owners_dir() / f"{owner}.lock"
+        try:
+            with open(path, "a") as fh:
+                try:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return True
+                fcntl.flock(fh, fcntl.LOCK_UN)
+        except OSError:
+            return False
+        path.unlink(missing_ok=True)
+        return False
+
+    # --- persistência ---
+    def _job_dir(self, job_id: str) -> Path | None:
+        if not self._ID_RE.match(job_id or ""):
+            return None
+        return self.directory / job_id
+
+    def _write(self, job: dict):
+        path = self.directory / job["id"] / "job.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(job), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def get(self, job_id: str) -> dict | None:
+        job_dir = self._job_dir(job_id)
+        if job_dir is None:
+            return None
+        try:
+            return json.loads((job_dir / "job.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def result_path(self, job: dict) -> Path:
+        return self.directory / job["id"] / (job.get("result") or {}).get("file", "output")
+
+    # --- execução ---
+    def start(self):
+        """Inicia o pool e recoloca na fila jobs interrompidos por restart (idempotente).
+
+        Chamado por iniciar_servicos() na subida do app; as rotas de jobs também o
+        chamam, como garantia.
+        """
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render-job")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._hold_owner_lock()
+        # Um processo por vez varre o diretório, para dois não retomarem o mesmo job
+        with open(self._owners_dir() / "recover.lock", "w") as guard:
+            if fcntl is not None:
+                fcntl.flock(guard, fcntl.LOCK_EX)
+            entradas = []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        entradas.append((entry.stat().st_mtime, entry.name))
+                    except OSError:
+                        continue  # removido pelo sweep de outro worker
+            for _, name in sorted(entradas):
+                job = self.get(name)
+                if job and job["status"] in ("queued", "running") and not self._owner_alive(job.get("owner")):
+                    job["status"] = "queued"
+                    job["owner"] = self._owner
+                    self._write(job)
+                    self._enqueue(job["id"])
+        self.sweep(force=True)
+
+    def _enqueue(self, job_id: str):
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._run, job_id)
+
+    def submit(self, html_text: str | None, html_file, opts: dict) -> dict:
+        self.start()
+        self.sweep()
+        with self._lock:
+            if self._pending + self._running >= self.max_queue:
+                raise QueueFull("Fila de render cheia; tente novamente mais tarde.")
+            self._stats["submitted"] += 1
+        job_id = uuid.uuid4().hex
+        job_dir = self.directory / job_id
+        (job_dir / "input").mkdir(parents=True)
+        html_path = write_temp_html(job_dir / "input", html_text=html_text, html_file=html_file)
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "owner": self._owner,
+            "html": html_path.name,
+            "options": opts,
+        }
+        self._write(job)
+        self._enqueue(job_id)
+        return job
+
+    def _run(self, job_id: str):
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+        job = self.get(job_id)
+        try:
+            if job is None:
+                return
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            self._write(job)
+            job_dir = self.directory / job_id
+            work = job_dir / "work"
+            shutil.rmtree(work, ignore_errors=True)
+            work.mkdir()
+            try:
+                out, mimetype, download_name = run_render(job_dir / "input" / job["html"], job["options"], work)
+                job["result"] = {"file": f"result{out.suffix}", "mimetype": mimetype, "download_name": download_name}
+                os.replace(out, self.result_path(job))
+                job["status"] = "done"
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+            finally:
+                shutil.rmtree(work, ignore_errors=True)
+            job["finished_at"] = time.time()
+            self._write(job)
+            with self._lock:
+                self._stats[job["status"]] += 1
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def sweep(self, force: bool = False):
+        """Remove jobs finalizados há mais de ttl_s (no máximo a cada 60 s)."""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < 60:
+                return
+            self._last_sweep = now
+        if not self.directory.is_dir():
+            return
+        for job_dir in self.directory.iterdir():
+            if self._job_dir(job_dir.name) is None:
+                continue  # .owners e afins
+            job = self.get(job_dir.name)
+            if job is None:
+                # Diretório órfão (job.json ausente/corrompido) antigo
+                try:
+                    if now - job_dir.stat().st_mtime > self.ttl_s:
+                        shutil.rmtree(job_dir, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            if job["status"] in ("done", "failed") and now - (job.get("finished_at") or now) > self.ttl_s:
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["queued"] = self._pending
+            data["running"] = self._running
+        data["workers"] = self.workers
+        data["max_queue"] = self.max_queue
+        data["ttl_s"] = self.ttl_s
+        return data
+
+
+render_jobs = RenderJobStore(RENDER_JOBS_DIR, RENDER_JOB_WORKERS, RENDER_JOB_MAX_QUEUE, RENDER_JOB_TTL_S)
+
+
+def iniciar_servicos():
+    """Serviços de fundo do app (retomada de jobs de render interrompidos).
+
+    Roda na subida do servidor, não na importação: processos filhos do pool
+    (forkserver/spawn) reimportam o módulo e não devem assumir jobs. Sob
+    gunicorn/uWSGI, chame no hook de início de cada worker (p.ex. post_worker_init).
+    """
+    render_jobs.start()
+
+
+def _render_job_view(job: dict) -> dict:
+    view = {k: job.get(k) for k in ("id", "status", "created_at", "started_at", "finished_at", "error")}
+    view["status_url"] = f"/render/jobs/{job['id']}"
+    if job.get("status") == "done":
+        view["result_url"] = f"/render/jobs/{job['id']}/resultado"
+        view["expires_at"] = (job.get("finished_at") or 0) + render_jobs.ttl_s
+    return view
+# -----------------------------------------------------------------------------
+
+
+@app.route("/render", methods=["POST"])
+def render():
+    """
+    POST /render
+    Form-data:
+      - file: arquivo .html  (opcional se mandar 'html')
+      - html: texto bruto do HTML (opcional se mandar 'file')
+      - content_seconds (float, opcional) | default CONTENT_SECONDS
+      - width,height (int, opcionais) | se omitidos e AUTO_SIZE_BODY=True → usa tamanho do <body>
+      - target_fps (int, opcional) | default TARGET_FPS
+      - auto_trim_head (bool), auto_trim_tail (bool) [0/1, true/false]
+      - zero_anim_delay (bool)
+      - scene_threshold, head_pad, tail_pad (opcionais)
+      - capture: realtime (padrão; grava em tempo real) | frames (tempo virtual, quadro a quadro)
+      - output: mp4 (padrão) | webm (WEBM capturado, cortado por stream copy; também via Accept: video/webm)
+      - renditions: JSON [{"width","height","fps","crf","container": mp4|webm}, ...] (várias saídas da mesma captura)
+      - posters: JSON [{"time","width","height","quality"}, ...] ou "0,1.5" (segundos)
+      - trim_source: auto (padrão) | timeline (eventos de animação da página) | scene (detecção de cena no vídeo)
+      - async (bool): enfileira o render e responde 202 com o id do job
+    Resposta: video/mp4 (attachment); ZIP com renditions/posters se pedidos; com async=1, JSON do job
+    """
+    try:
+        ensure_ffmpeg()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    html_file = request.files.get("file")
+    html_text = request.form.get("html")
+    if not html_file and not html_text:
+        return jsonify({"error": "Envie 'file' (multipart) OU 'html' (texto)."}), 400
+
+    # parâmetros opcionais
+    try:
+        opts = _parse_render_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Sem 'output' explícito, respeita o Accept (clientes que preferem WEBM evitam o libx264)
+    if not request.form.get("output"):
+        best = request.accept_mimetypes.best_match(["video/mp4", "video/webm"])
+        if best == "video/webm" and request.accept_mimetypes["video/webm"] > request.accept_mimetypes["video/mp4"]:
+            opts["output"] = "webm"
+
+    is_async = str(request.form.get("async", "0")).lower() in ("1", "true", "t", "yes", "y")
+    if is_async:
+        try:
+            job = render_jobs.submit(html_text, html_file, opts)
+        except QueueFull as e:
+            return jsonify({"error": str(e)}), 503
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        return jsonify(_render_job_view(job)), 202
 
     # -------- NÃO usar TemporaryDirectory como context manager (Windows lock) --------
     tmpdir_obj = tempfile.TemporaryDirectory(prefix="html2mp4_")
@@ -2186,40 +5092,14 @@ def render():
         html_path = write_temp_html(
             tmpdir, html_text=html_text, html_file=html_file
         )
-
-        # 1) descobrir tamanho
-        if AUTO_SIZE_BODY and (width is None or height is None):
-            w, h = measure_body_size(html_path)
-        else:
-            w = width or 1080
-            h = height or 1350
-
-        # 2) gravar WEBM com buffers
-        total = content_seconds + BUFFER_HEAD_S + BUFFER_TAIL_S
-        webm = record_webm(
-            html_path, total, w, h, tmpdir, zero_anim_delay=zero_anim_delay
-        )
-
-        # 3) auto-trim do início (e opcional do final), SEM cortar conteúdo
-        start, take = compute_trim(
-            webm,
-            auto_head=auto_trim_head,
-            auto_tail=auto_trim_tail,
-            head_pad=head_pad,
-            tail_pad=tail_pad,
-            scene_threshold=scene_threshold,
-        )
-
-        # 4) converter para MP4 com seek preciso (sem barras)
-        mp4_path = tmpdir / "output.mp4"
-        webm_to_mp4_precise(webm, mp4_path, start, take, w, h, target_fps)
+        out_path, mimetype, download_name = run_render(html_path, opts, tmpdir)
 
         # 5) devolver (passe string; Flask abre/fecha o arquivo)
         resp = send_file(
-            str(mp4_path),
-            mimetype="video/mp4",
+            str(out_path),
+            mimetype=mimetype,
             as_attachment=True,
-            download_name="render.mp4",
+            download_name=download_name,
             max_age=0,
             conditional=True,
         )
@@ -2231,6 +5111,321 @@ def render():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/render/jobs/<job_id>", methods=["GET"])
+def render_job_status(job_id):
+    render_jobs.start()
+    job = render_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado (ou expirado)."}), 404
+    return jsonify(_render_job_view(job))
+
+
+@app.route("/render/jobs/<job_id>/resultado", methods=["GET"])
+def render_job_result(job_id):
+    render_jobs.start()
+    job = render_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado (ou expirado)."}), 404
+    if job["status"] == "failed":
+        return jsonify({"error": job.get("error") or "Render falhou."}), 500
+    if job["status"] != "done":
+        return jsonify(_render_job_view(job)), 409
+    result = job.get("result") or {}
+    resp = send_file(
+        str(render_jobs.result_path(job)),
+        mimetype=result.get("mimetype", "video/mp4"),
+        as_attachment=True,
+        download_name=result.get("download_name", "render.mp4"),
+        max_age=0,
+        conditional=True,
+    )
+    resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
+    return resp
+
+
+# ------------------------ PDF → DOCX com páginas como imagem ------------------------
+# Modos raster/hybrid: páginas rasterizadas em paralelo (mesmo estado por processo de
+# /pdf-para-imagem) e entregues ao python-docx como streams em memória.
+
+
+def docx_pagina(doc, idx: int, dpi: int, fmt: str, quality: int | None, with_text: bool):
+    """Imagem da página no formato final e, no modo híbrido, o texto extraído."""
+    page = doc[idx]
+    data = pixmap_bytes(page.get_pixmap(dpi=dpi, alpha=False), fmt, quality)
+    text = None
+    if with_text:
+        try:
+            text = page.get_text("text") or ""
+        except Exception:
+            text = ""
+    return data, text
+
+
+def _docx_pagina(caminho: str, idx: int, dpi: int, fmt: str, quality: int | None, with_text: bool):
+    return docx_pagina(_doc_worker(caminho), idx, dpi, fmt, quality, with_text)
+
+
+def paginas_docx(pdf_bytes: bytes, pages: list[int], dpi: int, fmt: str, quality: int | None, with_text: bool):
+    """Gera (imagem, texto) de cada página na ordem; várias páginas vão para o pool."""
+    if len(pages) <= 1:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            for idx in pages:
+                yield docx_pagina(doc, idx, dpi, fmt, quality, with_text)
+        return
+    with pdf_para_pool(pdf_bytes) as caminho:
+        itens = [(caminho, idx, dpi, fmt, quality, with_text) for idx in pages]
+        for _, fut in _imap_bounded(_process_pool(), _docx_pagina, itens, ordered=True):
+            yield fut.result()
+
+
+# Modo editable: abaixo de DOCX_SPLIT_MIN_PAGES páginas o pdf2docx converte o
+# intervalo inteiro num único processo (mantém a análise entre páginas: cabeçalhos,
+# rodapés, tabelas e parágrafos que atravessam páginas), com orçamento de
+# DOCX_PAGE_BUDGET_S por página. Acima disso — ou se a conversão inteira falhar ou
+# estourar o orçamento — roda em processos separados, cada um com uma faixa
+# contígua de páginas; a página que estoura o orçamento (ou falha) tem o processo
+# encerrado e entra no DOCX final como imagem. Os DOCX parciais são mesclados na
+# ordem das páginas. O orçamento conta a partir do aviso do processo, já com os
+# módulos importados.
+#   DOCX_PAGE_BUDGET_S="30"     (segundos por página no modo editable)
+#   DOCX_SPLIT_MIN_PAGES="20"   (a partir daqui, conversão dividida por páginas)
+#   DOCX_FALLBACK_DPI="200"     (resolução das páginas que caem para imagem)
+DOCX_PAGE_BUDGET_S = float(os.getenv("DOCX_PAGE_BUDGET_S", "30"))
+DOCX_SPLIT_MIN_PAGES = max(1, int(os.getenv("DOCX_SPLIT_MIN_PAGES", "20")))
+DOCX_FALLBACK_DPI = int(os.getenv("DOCX_FALLBACK_DPI", "200"))
+DOCX_WORKER_STARTUP_S = 120  # limite para o processo novo importar o app e avisar
+
+
+def _editavel_inteiro_worker(pdf_path: str, start: int, end: int, out_path: str, conn):
+    """Converte as páginas [start, end) de uma vez; avisa ao subir e ao terminar."""
+    conn.send(("pronto", None))
+    try:
+        cv = Converter(pdf_path)
+        try:
+            cv.convert(out_path, start=start, end=end)
+        finally:
+            cv.close()
+        conn.send(("ok", None))
+    except Exception:
+        conn.send(("erro", None))
+    finally:
+        conn.close()
+
+
+def converter_editavel_inteiro(pdf_path: str, pages: list[int], out_path: str, *, budget: float) -> bool:
+    """Converte o intervalo contíguo `pages` num único processo pdf2docx.
+
+    Retorna False (o chamador cai na conversão dividida) se falhar, derrubar o
+    processo ou passar de `budget` segundos depois que o processo subiu.
+    """
+    recv_conn, send_conn = _MP_CTX.Pipe(duplex=False)
+    proc = _MP_CTX.Process(
+        target=_editavel_inteiro_worker,
+        args=(pdf_path, pages[0], pages[-1] + 1, out_path, send_conn),
+        daemon=True,
+    )
+    proc.start()
+    send_conn.close()
+    ok = False
+    try:
+        limite = DOCX_WORKER_STARTUP_S
+        while recv_conn.poll(limite):
+            kind, _ = recv_conn.recv()
+            if kind != "pronto":
+                ok = kind == "ok"
+                break
+            limite = budget
+    except (EOFError, OSError):
+        ok = False
+    finally:
+        if proc.is_alive():
+            proc.kill()
+        proc.join()
+        recv_conn.close()
+    return ok
+
+
+def _editavel_worker(pdf_path: str, pages: list[int], out_dir: str, conn):
+    """Converte as páginas uma a uma, avisando o início e o fim de cada uma."""
+    conn.send(("pronto", None))
+    try:
+        cv = Converter(pdf_path)
+    except Exception:
+        conn.send(("falha", None))
+        conn.close()
+        return
+    try:
+        for idx in pages:
+            conn.send(("inicio", idx))
+            try:
+                cv.convert(os.path.join(out_dir, f"p{idx:05d}.docx"), pages=[idx])
+                conn.send(("ok", idx))
+            except Exception:
+                conn.send(("erro", idx))
+    finally:
+        cv.close()
+        conn.close()
+
+
+def converter_editavel(pdf_path: str, pages: list[int], out_dir: str, *, workers: int, budget: float) -> dict:
+    """Converte `pages` com pdf2docx em até `workers` processos.
+
+    Retorna {página: caminho do DOCX parcial}. Páginas que estouram `budget`,
+    falham ou derrubam o processo ficam de fora (o chamador faz o fallback); o
+    restante da faixa segue num processo novo. O relógio de cada processo começa
+    quando ele avisa que subiu (módulos importados): se não abrir o PDF dentro de
+    `budget`, a faixa inteira vai para o fallback.
+    """
+    ctx = _MP_CTX
+    n = max(1, min(workers, len(pages)))
+    size = math.ceil(len(pages) / n)
+    ativos = {}
+    prontos = {}
+    seq = itertools.count()
+
+    def _iniciar(chunk):
+        recv_conn, send_conn = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=_editavel_worker, args=(pdf_path, chunk, out_dir, send_conn), daemon=True)
+        proc.start()
+        send_conn.close()
+        ativos[next(seq)] = {
+            "proc": proc, "conn": recv_conn, "pendentes": list(chunk),
+            "atual": None, "desde": time.monotonic(), "fase": "subindo",
+        }
+
+    def _encerrar(wid, descartar=None, reiniciar=True):
+        st = ativos.pop(wid)
+        if st["proc"].is_alive():
+            st["proc"].kill()
+        st["proc"].join()
+        st["conn"].close()
+        resto = [p for p in st["pendentes"] if p != descartar]
+        if resto and reiniciar:
+            _iniciar(resto)
+
+    for i in range(0, len(pages), size):
+        _iniciar(pages[i:i + size])
+
+    while ativos:
+        conns = {st["conn"]: wid for wid, st in ativos.items()}
+        for conn in mp_connection.wait(list(conns), timeout=0.25):
+            wid = conns[conn]
+            st = ativos.get(wid)
+            if st is None:
+                continue
+            try:
+                kind, idx = conn.recv()
+            except (EOFError, OSError):
+                # Processo terminou; se sobrou página, ele caiu nela
+                pendentes = st["pendentes"]
+                atual = st["atual"] if st["atual"] is not None else (pendentes[0] if pendentes else None)
+                _encerrar(wid, atual)
+                continue
+            if kind == "falha":
+                _encerrar(wid, reiniciar=False)
+                continue
+            st["desde"] = time.monotonic()
+            if kind == "pronto":
+                st["fase"] = "abrindo"
+                continue
+            st["fase"] = "convertendo"
+            if kind == "inicio":
+                st["atual"] = idx
+            else:
+                if idx in st["pendentes"]:
+                    st["pendentes"].remove(idx)
+                st["atual"] = None
+                if kind == "ok":
+                    prontos[idx] = os.path.join(out_dir, f"p{idx:05d}.docx")
+
+        agora = time.monotonic()
+        for wid, st in list(ativos.items()):
+            limite = DOCX_WORKER_STARTUP_S if st["fase"] == "subindo" else budget
+            if agora - st["desde"] <= limite:
+                continue
+            if st["fase"] != "convertendo":
+                # Travou subindo ou abrindo o PDF (antes da primeira página): o
+                # mesmo aconteceria num processo novo, então a faixa vai para o fallback
+                _encerrar(wid, reiniciar=False)
+            else:
+                atual = st["atual"] if st["atual"] is not None else (st["pendentes"] or [None])[0]
+                _encerrar(wid, atual)
+    return prontos
+
+
+def _remapear_rels(el, src_part, dst_part):
+    """Traz para `dst_part` as imagens e links externos referenciados por `el`."""
+    for blip in el.iter(qn("a:blip")):
+        rid = blip.get(qn("r:embed"))
+        if rid and rid in src_part.rels:
+            novo, _ = dst_part.get_or_add_image(BytesIO(src_part.related_parts[rid].blob))
+            blip.set(qn("r:embed"), novo)
+    for link in el.iter(qn("w:hyperlink")):
+        rid = link.get(qn("r:id"))
+        rel = src_part.rels.get(rid) if rid else None
+        if rel is not None and rel.is_external:
+            link.set(qn("r:id"), dst_part.relate_to(rel.target_ref, rel.reltype, is_external=True))
+
+
+def _quebra_secao(body, sect_pr):
+    """Fecha a seção corrente com `sect_pr` (parágrafo com w:sectPr antes do final do corpo)."""
+    p = OxmlElement("w:p")
+    ppr = OxmlElement("w:pPr")
+    ppr.append(sect_pr)
+    p.append(ppr)
+    body.sectPr.addprevious(p)
+    return p
+
+
+def _sect_pr_pagina(w_pt: float, h_pt: float):
+    """Seção do tamanho da página do PDF, sem margens (para páginas em imagem)."""
+    sect = OxmlElement("w:sectPr")
+    pg_sz = OxmlElement("w:pgSz")
+    pg_sz.set(qn("w:w"), str(round(w_pt * 20)))
+    pg_sz.set(qn("w:h"), str(round(h_pt * 20)))
+    if w_pt > h_pt:
+        pg_sz.set(qn("w:orient"), "landscape")
+    pg_mar = OxmlElement("w:pgMar")
+    for lado in ("top", "right", "bottom", "left", "header", "footer", "gutter"):
+        pg_mar.set(qn(f"w:{lado}"), "0")
+    sect.append(pg_sz)
+    sect.append(pg_mar)
+    return sect
+
+
+def mesclar_docx(partes: list, out_path: str):
+    """Junta, em ordem, DOCX parciais ("docx", caminho) e páginas em imagem
+    ("imagem", (bytes, largura_pt, altura_pt)), cada uma na sua própria seção.
+    """
+    base = Document()
+    body = base.element.body
+    ultima = None
+    for tipo, valor in partes:
+        if tipo == "docx":
+            src = Document(valor)
+            src_body = src.element.body
+            src_sect = src_body.sectPr
+            for el in list(src_body.iterchildren()):
+                if el is src_sect:
+                    continue
+                el = deepcopy(el)
+                _remapear_rels(el, src.part, base.part)
+                body.sectPr.addprevious(el)
+            sect = deepcopy(src_sect) if src_sect is not None else deepcopy(body.sectPr)
+        else:
+            img_bytes, w_pt, h_pt = valor
+            # um pouco menor que a página para não empurrar o parágrafo para a próxima
+            base.add_picture(BytesIO(img_bytes), width=Emu(round(w_pt * 12700 * 0.98)), height=Emu(round(h_pt * 12700 * 0.98)))
+            sect = _sect_pr_pagina(w_pt, h_pt)
+        ultima = _quebra_secao(body, sect)
+    # A última seção vira a seção final do corpo
+    if ultima is not None:
+        sect = ultima.find(qn("w:pPr")).find(qn("w:sectPr"))
+        body.remove(ultima)
+        body.replace(body.sectPr, sect)
+    base.save(out_path)
+
+
 @app.route('/pdf-para-docx', methods=['POST'])
 def pdf_para_docx():
     """
@@ -2241,11 +5436,15 @@ def pdf_para_docx():
     Entrada (multipart/form-data):
       - file: PDF (alternativa: pdf_url)
       - pdf_url: URL para um PDF (opcional se enviar file)
-      - mode: editable | raster (padrão: editable)
+      - mode: editable | raster | hybrid (padrão: editable)
       - dpi: (raster) resolução para rasterização (padrão: 300)
+      - image_format: (raster/hybrid) png (padrão) | jpeg
+      - quality: (raster/hybrid, jpeg) 1-100 (padrão: 85)
       - page_size: (raster) A4 | Letter (padrão: A4)
       - margin_top, margin_right, margin_bottom, margin_left (em mm, opcionais — raster)
       - start_page, end_page: intervalo (0-based inclusive/exclusive) para conversão (editable)
+      - page_budget_s: (editable) tempo máximo por página antes de inseri-la como imagem
+        (padrão: DOCX_PAGE_BUDGET_S)
       - filename: nome do arquivo de saída (opcional)
     """
     # Fonte: arquivo ou URL
@@ -2277,6 +5476,18 @@ def pdf_para_docx():
     except ValueError:
         dpi = 300
 
+    image_format = (request.form.get('image_format') or request.form.get('formato_imagem') or 'png').strip().lower()
+    if image_format == 'jpg':
+        image_format = 'jpeg'
+    if image_format not in ('png', 'jpeg'):
+        return jsonify({"error": "image_format deve ser 'png' ou 'jpeg'."}), 400
+    try:
+        quality = int(request.form.get('quality') or request.form.get('qualidade') or 85)
+        if not (1 <= quality <= 100):
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "quality deve ser inteiro entre 1 e 100"}), 400
+
     page_size = (request.form.get('page_size') or 'A4').strip().lower()
     if page_size not in ('a4', 'letter'):
         page_size = 'a4'
@@ -2304,9 +5515,7 @@ def pdf_para_docx():
             uploaded.stream.seek(0)
             pdf_bytes = uploaded.read()
         else:
-            resp = requests.get(pdf_url, timeout=30)
-            resp.raise_for_status()
-            pdf_bytes = resp.content
+            pdf_bytes = fetch_url_bytes(pdf_url, timeout=30)
         if not pdf_bytes:
             return jsonify({"error": "PDF vazio."}), 400
 
@@ -2336,63 +5545,56 @@ def pdf_para_docx():
         if mode == 'editable':
             if Converter is None:
                 return jsonify({"error": "Conversão editável requer 'pdf2docx'. Instale as dependências (requirements/Docker)."}), 500
-            # Conversão via pdf2docx
-            cv = Converter(tmp_pdf_path)
-            cv.convert(out_path, start=start_i, end=end_i)
-            cv.close()
-        elif mode == 'hybrid':
-            # Híbrido: insere imagem da página e adiciona texto extraído embaixo (editável)
-            doc_pdf = fitz.open(stream=pdf_bytes, filetype='pdf')
-            if len(doc_pdf) == 0:
-                return jsonify({"error": "PDF sem páginas."}), 400
             if Document is None:
                 return jsonify({"error": "python-docx não está disponível no ambiente."}), 500
-            docx = Document()
-            section = docx.sections[0]
-            if Mm:
-                if page_size == 'a4':
-                    section.page_width = Mm(210)
-                    section.page_height = Mm(297)
-                else:
-                    section.page_width = Mm(215.9)
-                    section.page_height = Mm(279.4)
-                section.top_margin = _mm(margin_top, section.top_margin)
-                section.right_margin = _mm(margin_right, section.right_margin)
-                section.bottom_margin = _mm(margin_bottom, section.bottom_margin)
-                section.left_margin = _mm(margin_left, section.left_margin)
-            page_width_emu = section.page_width - section.left_margin - section.right_margin if Mm else None
-            tmpdir_obj = tempfile.TemporaryDirectory(prefix="pdf2docx_hybrid_")
-            tmpdir = Path(tmpdir_obj.name)
-            total_pages = len(doc_pdf)
+            try:
+                page_budget = float(request.form.get('page_budget_s') or DOCX_PAGE_BUDGET_S)
+                if page_budget <= 0:
+                    raise ValueError
+            except ValueError:
+                return jsonify({"error": "page_budget_s deve ser um número positivo"}), 400
+            with fitz.open(stream=pdf_bytes, filetype='pdf') as doc_pdf:
+                tamanhos = [(pg.rect.width, pg.rect.height) for pg in doc_pdf]
+            total_pages = len(tamanhos)
             real_end = end_i if (end_i is not None and end_i <= total_pages) else total_pages
             real_start = max(0, min(start_i, total_pages))
-            for idx in range(real_start, real_end):
-                page = doc_pdf[idx]
-                # Imagem da página
-                pix = page.get_pixmap(dpi=dpi, alpha=False)
-                img_path = tmpdir / f"page_{idx+1}.png"
-                img_path.write_bytes(pix.tobytes('png'))
-                if page_width_emu is not None:
-                    pic = docx.add_picture(str(img_path))
-                    pic.width = page_width_emu
-                else:
-                    docx.add_picture(str(img_path))
-                # Texto extraído (editável) logo abaixo
+            pages = list(range(real_start, real_end))
+            if not pages:
+                return jsonify({"error": "Nenhuma página no intervalo informado."}), 400
+
+            # Documentos pequenos: pdf2docx no intervalo inteiro, de uma vez
+            fallback = []
+            inteiro = len(pages) < DOCX_SPLIT_MIN_PAGES and converter_editavel_inteiro(
+                tmp_pdf_path, pages, out_path, budget=page_budget * len(pages),
+            )
+            if not inteiro:
+                # Documento grande (ou a conversão inteira falhou/estourou):
+                # em paralelo por faixas de páginas
+                partes_dir = tempfile.TemporaryDirectory(prefix="pdf2docx_partes_")
                 try:
-                    text = page.get_text("text") or ""
-                except Exception:
-                    text = ""
-                if text.strip():
-                    for para in text.splitlines():
-                        p = docx.add_paragraph(para)
-                # Quebra de página se não for a última
-                if idx < (real_end - 1):
-                    docx.add_page_break()
-            docx.save(out_path)
+                    prontos = converter_editavel(
+                        tmp_pdf_path, pages, partes_dir.name,
+                        workers=PROCESS_WORKERS, budget=page_budget,
+                    )
+                    fallback = [idx for idx in pages if idx not in prontos]
+                    imagens = {}
+                    if fallback:
+                        resultados = paginas_docx(pdf_bytes, fallback, DOCX_FALLBACK_DPI, image_format, quality, False)
+                        imagens = {idx: img for idx, (img, _) in zip(fallback, resultados)}
+                    partes = [
+                        ("docx", prontos[idx]) if idx in prontos else ("imagem", (imagens[idx], *tamanhos[idx]))
+                        for idx in pages
+                    ]
+                    mesclar_docx(partes, out_path)
+                finally:
+                    partes_dir.cleanup()
         else:
-            # Raster (fidelidade visual), docx com imagens
-            doc_pdf = fitz.open(stream=pdf_bytes, filetype='pdf')
-            if len(doc_pdf) == 0:
+            # Raster (fidelidade visual), docx com imagens; no híbrido, com o texto
+            # extraído (editável) logo abaixo de cada imagem
+            with_text = mode == 'hybrid'
+            with fitz.open(stream=pdf_bytes, filetype='pdf') as doc_pdf:
+                total_pages = len(doc_pdf)
+            if total_pages == 0:
                 return jsonify({"error": "PDF sem páginas."}), 400
             if Document is None:
                 return jsonify({"error": "python-docx não está disponível no ambiente."}), 500
@@ -2410,36 +5612,41 @@ def pdf_para_docx():
                 section.bottom_margin = _mm(margin_bottom, section.bottom_margin)
                 section.left_margin = _mm(margin_left, section.left_margin)
             page_width_emu = section.page_width - section.left_margin - section.right_margin if Mm else None
-            tmpdir_obj = tempfile.TemporaryDirectory(prefix="pdf2docx_")
-            tmpdir = Path(tmpdir_obj.name)
-            total_pages = len(doc_pdf)
             real_end = end_i if (end_i is not None and end_i <= total_pages) else total_pages
             real_start = max(0, min(start_i, total_pages))
-            for idx in range(real_start, real_end):
-                page = doc_pdf[idx]
-                pix = page.get_pixmap(dpi=dpi, alpha=False)
-                img_path = tmpdir / f"page_{idx+1}.png"
-                img_path.write_bytes(pix.tobytes('png'))
+            pages = list(range(real_start, real_end))
+            resultados = paginas_docx(pdf_bytes, pages, dpi, image_format, quality, with_text)
+            for idx, (img_bytes, text) in zip(pages, resultados):
+                img_stream = BytesIO(img_bytes)
                 if page_width_emu is not None:
-                    pic = docx.add_picture(str(img_path))
+                    pic = docx.add_picture(img_stream)
                     pic.width = page_width_emu
                 else:
-                    docx.add_picture(str(img_path))
+                    docx.add_picture(img_stream)
+                if text and text.strip():
+                    for para in text.splitlines():
+                        docx.add_paragraph(para)
+                # Quebra de página se não for a última
                 if idx < (real_end - 1):
                     docx.add_page_break()
             docx.save(out_path)
 
         # Enviar
-        return send_file(
+        resp = send_file(
             out_path,
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
             as_attachment=True,
             download_name=(desired_name or 'convertido.docx')
         )
+        if mode == 'editable' and fallback:
+            # Páginas (1-based) que entraram como imagem
+            resp.headers['X-Raster-Fallback-Pages'] = ",".join(str(idx + 1) for idx in fallback)
+        return resp
     except requests.RequestException as e:
         return jsonify({"error": f"Falha ao baixar PDF: {str(e)}"}), 400
     except Exception as e:
         return jsonify({"error": f"Falha ao converter PDF para DOCX: {str(e)}"}), 500
 
 if __name__ == '__main__':
+    iniciar_servicos()
     app.run(host="0.0.0.0", port=5000)